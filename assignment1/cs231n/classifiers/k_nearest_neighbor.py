@@ -3,10 +3,18 @@ import numpy as np
 class KNearestNeighbor(object):
   """ a kNN classifier with L2 distance """
 
-  def __init__(self):
-    pass
+  def __init__(self, memory_budget=256 * 1024 ** 2):
+    """
+    Inputs:
+    - memory_budget: Maximum number of bytes used for a single block of the
+      test / train distance matrix. The fully vectorized code paths never hold
+      more than one such block in memory at a time. The k-means of the
+      approximate index gathers at most this many bytes of training points at
+      a time.
+    """
+    self.memory_budget = memory_budget
 
-  def train(self, X, y):
+  def train(self, X, y, num_cells=0, num_iters=10):
     """
     Train the classifier. For k-nearest neighbors this is just 
     memorizing the training data.
@@ -16,11 +24,63 @@ class KNearestNeighbor(object):
       consisting of num_train samples each of dimension D.
     - y: A numpy array of shape (N,) containing the training labels, where
          y[i] is the label for X[i].
+    - num_cells: If positive, also build an approximate nearest neighbor
+      index that partitions the training data into this many k-means cells.
+    - num_iters: Number of k-means iterations used to build the index.
     """
     self.X_train = X
     self.y_train = y
-    
-  def predict(self, X, k=1, num_loops=0):
+    # Squared norms of the training points are reused by every distance block
+    self.train_sq_norms = np.sum(np.square(X), axis=1)
+    self.num_labels = np.max(y) + 1
+
+    self.centroids = None
+    if num_cells > 0:
+      self._build_index(num_cells, num_iters)
+
+  def _build_index(self, num_cells, num_iters):
+    """
+    Build an inverted file (IVF) index over the training data: run k-means to
+    find num_cells centroids, then store the training points sorted by cell so
+    that the members of cell c are self.cell_order[cell_starts[c]:
+    cell_starts[c + 1]].
+    """
+    num_train = self.X_train.shape[0]
+    num_cells = min(num_cells, num_train)
+    init = np.random.choice(num_train, num_cells, replace=False)
+    centroids = self.X_train[init].astype(np.float64)
+    row_bytes = self.X_train.itemsize * self.X_train.shape[1]
+    block_rows = max(1, self.memory_budget // row_bytes)
+    for it in xrange(num_iters + 1):
+      centroid_dists = -2 * self.X_train.dot(centroids.T)
+      centroid_dists += np.sum(np.square(centroids), axis=1)
+      assignments = np.argmin(centroid_dists, axis=1)
+      if it == num_iters:
+        break
+      # Move every centroid to the mean of its members; empty cells stay put.
+      # The per-cell sums add up the training points sorted by cell with
+      # np.add.reduceat, gathering block_rows of them at a time.
+      counts = np.bincount(assignments, minlength=num_cells)
+      order = np.argsort(assignments, kind='mergesort')
+      sorted_cells = assignments[order]
+      sums = np.zeros_like(centroids)
+      for start in xrange(0, num_train, block_rows):
+        block_cells = sorted_cells[start:start + block_rows]
+        # First row of every cell in the block
+        firsts = np.flatnonzero(np.concatenate(
+            ([True], block_cells[1:] != block_cells[:-1])))
+        block = self.X_train[order[start:start + block_rows]]
+        sums[block_cells[firsts]] += np.add.reduceat(block, firsts, axis=0,
+                                                     dtype=sums.dtype)
+      nonempty = counts > 0
+      centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+
+    self.centroids = centroids
+    self.cell_order = np.argsort(assignments, kind='mergesort')
+    self.cell_starts = np.concatenate(([0], np.cumsum(
+        np.bincount(assignments, minlength=num_cells))))
+
+  def predict(self, X, k=1, num_loops=0, num_probes=None):
     """
     Predict labels for test data using this classifier.
 
@@ -30,13 +90,22 @@ class KNearestNeighbor(object):
     - k: The number of nearest neighbors that vote for the predicted labels.
     - num_loops: Determines which implementation to use to compute distances
       between training points and testing points.
+    - num_probes: If given, query the approximate index built by train()
+      instead, searching the num_probes cells closest to each test point.
+      Larger values trade speed for recall; num_probes equal to the number of
+      cells gives exact results.
 
     Returns:
     - y: A numpy array of shape (num_test,) containing predicted labels for the
       test data, where y[i] is the predicted label for the test point X[i].  
     """
-    if num_loops == 0:
-      dists = self.compute_distances_no_loops(X)
+    if num_probes is not None:
+      closest_idx = self.compute_nearest_index(X, k, num_probes)
+      closest_y = np.where(closest_idx >= 0, self.y_train[closest_idx], -1)
+      return self._vote(closest_y)
+    elif num_loops == 0:
+      closest_idx = self.compute_nearest_no_loops(X, k)
+      return self._vote(self.y_train[closest_idx])
     elif num_loops == 1:
       dists = self.compute_distances_one_loop(X)
     elif num_loops == 2:
@@ -46,6 +115,68 @@ class KNearestNeighbor(object):
 
     return self.predict_labels(dists, k=k)
 
+  def cross_validate(self, X, y, k_choices, num_folds=5):
+    """
+    Run num_folds-fold cross-validation over several values of k.
+
+    The data is split into contiguous folds with np.array_split. Every block of
+    distances between two folds is computed exactly once and used for both
+    folds, and only the max(k_choices) nearest neighbors of every point are
+    kept; each value of k is then scored from a prefix of that sorted list.
+    The whole sweep therefore costs a single pass over all pairs of points,
+    independent of the number of values of k.
+
+    After this method returns the classifier is trained on all of X.
+
+    Inputs:
+    - X: A numpy array of shape (N, D) containing the data.
+    - y: A numpy array of shape (N,) containing the labels.
+    - k_choices: A list of values of k to evaluate.
+    - num_folds: The number of folds.
+
+    Returns:
+    - k_to_accuracies: A dictionary mapping each k in k_choices to a list of
+      length num_folds giving the validation accuracy on every fold.
+    """
+    self.train(X, y)
+    num_points = X.shape[0]
+    max_k = max(k_choices)
+    fold_ends = np.cumsum([len(f) for f in np.array_split(y, num_folds)])
+    fold_starts = np.concatenate(([0], fold_ends[:-1]))
+
+    fold_classifiers = []
+    for start, end in zip(fold_starts, fold_ends):
+      fold_classifier = KNearestNeighbor(self.memory_budget)
+      fold_classifier.train(X[start:end], y[start:end])
+      fold_classifiers.append(fold_classifier)
+
+    # Running top-k of every point over the points of all the other folds
+    closest_dists = np.full((num_points, max_k), np.inf)
+    closest_idx = np.full((num_points, max_k), -1, dtype=np.intp)
+    for i in xrange(num_folds):
+      for j in xrange(i + 1, num_folds):
+        blocks = fold_classifiers[j]._distance_blocks(
+            X[fold_starts[i]:fold_ends[i]])
+        for (i0, i1), (j0, j1), block in blocks:
+          rows = np.arange(fold_starts[i] + i0, fold_starts[i] + i1)
+          cols = np.arange(fold_starts[j] + j0, fold_starts[j] + j1)
+          for r, c, d in [(rows, cols, block), (cols, rows, block.T)]:
+            dists = np.hstack((closest_dists[r], d))
+            idx = np.hstack((closest_idx[r], np.broadcast_to(c, d.shape)))
+            closest_dists[r], closest_idx[r] = self._smallest_k(dists, idx,
+                                                                max_k)
+
+    order = np.argsort(closest_dists, axis=1)
+    closest_idx = closest_idx[np.arange(num_points)[:, np.newaxis], order]
+    closest_y = np.where(closest_idx >= 0, y[closest_idx], -1)
+
+    k_to_accuracies = {}
+    for k in k_choices:
+      y_pred = self._vote(closest_y[:, :k])
+      k_to_accuracies[k] = [np.mean(y_pred[start:end] == y[start:end])
+                            for start, end in zip(fold_starts, fold_ends)]
+    return k_to_accuracies
+
   def compute_distances_two_loops(self, X):
     """
     Compute the distance between each test point in X and each training point
@@ -116,8 +247,6 @@ class KNearestNeighbor(object):
 
     Input / Output: Same as compute_distances_two_loops
     """
-    #There seems to be a bug in this function... However the distance between the other two (correct) functions seems to be correct
-    #Hmmm, strange... That means all these algorithms are incorrect? Time for another debugging session
     num_test = X.shape[0]
     num_train = self.X_train.shape[0]
     dists = np.zeros((num_test, num_train)) 
@@ -133,45 +262,169 @@ class KNearestNeighbor(object):
     # HINT: Try to formulate the l2 distance using matrix multiplication    #
     #       and two broadcast sums.                                         #
     #########################################################################
-
-
-    # print 'HEY!', X.shape
-    # print self.X_train.shape
-    # #using binomial 'expansion'
-    # #sigma(A - B)^2 = sigma(A^2 - 2*A*B + B^2)
-    A = np.sum( np.square(X), axis=1)
-    # print "A", A.shape
-    B = np.sum( np.square(self.X_train), axis = 1).T
-    # print "B", B.shape
-    AB = np.dot(X, self.X_train.T)
-    # print "AB", AB.shape
-    dists = -2 * AB
-    # print "inner", dists.shape
-    dists += B
-    # print "inner1", dists.shape
-    dists += np.matrix(A).T
-    # print "inner2", dists.shape       #Want to add this to every sample, so equivalent to matrix addition
-
-
-    # A = np.sum(np.square(X), axis=1)
-    # B = np.sum(np.square(self.X_train), axis=1)
-    # print 'A', A.shape
-    # print 'B', B.shape
-    # C = -2 * np.dot(X, self.X_train.T)
-    #
-    # print 'C', C.shape
-    # dists = np.sum(A + B.T - AB, axis=1)
-
-    # X_tmp = np.reshape(X, (num_test, -1))
-    # X_tmp = np.repeat(X_tmp, 10, axis=0)
-    # X_train_tmp = np.repeat(self.X_train, )
-    # X_train_tmp = np.reshape(self.X_train, (num_train, -1))
-    # dists = np.sum(np.power(X_train_tmp - X_tmp, 2), axis=0)
+    # sum (A - B)^2 = sum A^2 - 2 * A.B + sum B^2, evaluated block by block so
+    # that no temporary is ever larger than a single block.
+    for (i0, i1), (j0, j1), block in self._distance_blocks(X):
+      dists[i0:i1, j0:j1] = block
     #########################################################################
     #                         END OF YOUR CODE                              #
     #########################################################################
     return dists
 
+  def compute_nearest_no_loops(self, X, k=1):
+    """
+    Find the k nearest training points of each test point in X without ever
+    materializing the full (num_test, num_train) distance matrix.
+
+    Distances are computed in blocks of at most self.memory_budget bytes and
+    only a running top-k of (distance, index) pairs is kept for every test
+    point.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing test data.
+    - k: The number of nearest neighbors to return.
+
+    Returns:
+    - closest_idx: A numpy array of shape (num_test, k) where closest_idx[i]
+      holds the indices into self.X_train of the k training points closest to
+      the ith test point, ordered by increasing distance.
+    """
+    num_test = X.shape[0]
+    num_train = self.X_train.shape[0]
+    k = min(k, num_train)
+    closest_dists = np.zeros((num_test, k))
+    closest_idx = np.zeros((num_test, k), dtype=np.intp)
+    for (i0, i1), (j0, j1), block in self._distance_blocks(X):
+      block_idx = np.broadcast_to(np.arange(j0, j1), block.shape)
+      if j0 > 0:
+        # Merge the candidates of this block with the running top-k
+        block = np.hstack((row_dists, block))
+        block_idx = np.hstack((row_idx, block_idx))
+      row_dists, row_idx = self._smallest_k(block, block_idx, k)
+      if j1 == num_train:
+        closest_dists[i0:i1] = row_dists
+        closest_idx[i0:i1] = row_idx
+
+    order = np.argsort(closest_dists, axis=1)
+    return closest_idx[np.arange(num_test)[:, np.newaxis], order]
+
+  def compute_nearest_index(self, X, k=1, num_probes=1):
+    """
+    Approximate version of compute_nearest_no_loops that only searches the
+    num_probes index cells whose centroids are closest to each test point.
+    Requires train() to have been called with num_cells > 0.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing test data.
+    - k: The number of nearest neighbors to return.
+    - num_probes: The number of cells to search for every test point.
+
+    Returns:
+    - closest_idx: A numpy array of shape (num_test, k) of indices into
+      self.X_train, ordered by increasing distance. If fewer than k training
+      points fall into the probed cells the missing entries are -1.
+    """
+    if self.centroids is None:
+      raise ValueError('No index was built; call train() with num_cells > 0')
+    num_test = X.shape[0]
+    num_cells = self.centroids.shape[0]
+    num_probes = min(num_probes, num_cells)
+    k = min(k, self.X_train.shape[0])
+
+    test_sq_norms = np.sum(np.square(X), axis=1)
+    centroid_dists = -2 * X.dot(self.centroids.T)
+    centroid_dists += np.sum(np.square(self.centroids), axis=1)
+    probes = np.argpartition(centroid_dists, num_probes - 1, axis=1)
+    probes = probes[:, :num_probes]
+
+    # Visit every cell once, scoring all the test points that probe it and
+    # merging the results into their running top-k.
+    closest_dists = np.full((num_test, k), np.inf)
+    closest_idx = np.full((num_test, k), -1, dtype=np.intp)
+    for c in xrange(num_cells):
+      rows = np.flatnonzero(np.any(probes == c, axis=1))
+      members = self.cell_order[self.cell_starts[c]:self.cell_starts[c + 1]]
+      if rows.size == 0 or members.size == 0:
+        continue
+      dists = -2 * X[rows].dot(self.X_train[members].T)
+      dists += self.train_sq_norms[members]
+      dists += test_sq_norms[rows, np.newaxis]
+      dists = np.hstack((closest_dists[rows], dists))
+      idx = np.hstack((closest_idx[rows],
+                       np.broadcast_to(members, (rows.size, members.size))))
+      closest_dists[rows], closest_idx[rows] = self._smallest_k(dists, idx, k)
+
+    order = np.argsort(closest_dists, axis=1)
+    return closest_idx[np.arange(num_test)[:, np.newaxis], order]
+
+  def _smallest_k(self, dists, idx, k):
+    """
+    Select the (at most) k smallest entries of every row of dists, together
+    with the matching entries of idx. The selected entries are not sorted.
+    """
+    if dists.shape[1] <= k:
+      return dists, idx
+    part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    rows = np.arange(dists.shape[0])[:, np.newaxis]
+    return dists[rows, part], idx[rows, part]
+
+  def _distance_blocks(self, X):
+    """
+    Generate the squared l2 distances between X and self.X_train one block at a
+    time, walking the test points in the outer loop and the training points in
+    the inner loop.
+
+    A block covers all training points whenever a full distance row fits in
+    self.memory_budget; otherwise single test rows are tiled over the training
+    set.
+
+    Yields tuples ((i0, i1), (j0, j1), block) where block is a numpy array of
+    shape (i1 - i0, j1 - j0) holding the distances between X[i0:i1] and
+    self.X_train[j0:j1].
+    """
+    num_test = X.shape[0]
+    num_train = self.X_train.shape[0]
+    itemsize = np.result_type(X, self.X_train).itemsize
+    max_cells = max(1, self.memory_budget // itemsize)
+    train_block = min(num_train, max_cells)
+    test_block = max(1, min(num_test, max_cells // train_block))
+
+    test_sq_norms = np.sum(np.square(X), axis=1)
+    for i0 in xrange(0, num_test, test_block):
+      i1 = min(i0 + test_block, num_test)
+      for j0 in xrange(0, num_train, train_block):
+        j1 = min(j0 + train_block, num_train)
+        block = X[i0:i1].dot(self.X_train[j0:j1].T)
+        block *= -2
+        block += self.train_sq_norms[j0:j1]
+        block += test_sq_norms[i0:i1, np.newaxis]
+        yield (i0, i1), (j0, j1), block
+
+  def _vote(self, closest_y):
+    """
+    Majority vote over the labels of the nearest neighbors of each test point,
+    breaking ties by choosing the smaller label.
+
+    Inputs:
+    - closest_y: A numpy array of shape (num_test, k) giving the labels of the
+      k nearest neighbors of each test point. Entries equal to -1 mark missing
+      neighbors and do not vote.
+
+    Returns:
+    - y: A numpy array of shape (num_test,) containing predicted labels.
+    """
+    num_test = closest_y.shape[0]
+    num_labels = self.num_labels
+    # Count all (row, label) pairs with a single bincount by giving every test
+    # point its own range of num_labels bins. argmax returns the first maximum,
+    # which is the smallest label among the tied ones.
+    offsets = num_labels * np.arange(num_test)[:, np.newaxis]
+    valid = closest_y >= 0
+    counts = np.bincount((np.where(valid, closest_y, 0) + offsets).ravel(),
+                         weights=valid.ravel(),
+                         minlength=num_test * num_labels)
+    return np.argmax(counts.reshape(num_test, num_labels), axis=1)
+
   def predict_labels(self, dists, k=1):
     """
     Given a matrix of distances between test points and training points,
@@ -185,59 +438,28 @@ class KNearestNeighbor(object):
     - y: A numpy array of shape (num_test,) containing predicted labels for the
       test data, where y[i] is the predicted label for the test point X[i].  
     """
-    num_test = dists.shape[0]
-    y_pred = np.zeros(num_test)
-    for i in xrange(num_test):
-      # A list of length k storing the labels of the k nearest neighbors to
-      # the ith test point.
-      # closest_y = []
-      # print self.y_train
-      # print max(self.y_train)
-      ##closest_y = np.zeros((10, 1))
-      # print 'Closest_y', closest_y.shape
-      
-      #########################################################################
-      # TODO:                                                                 #
-      # Use the distance matrix to find the k nearest neighbors of the ith    #
-      # testing point, and use self.y_train to find the labels of these       #
-      # neighbors. Store these labels in closest_y.                           #
-      # Hint: Look up the function numpy.argsort.                             #
-      #########################################################################
-
-      #sort smallest k distances in ascending order
-
-      index_of_smallest_k = self.y_train[dists[i, :].argsort()[:k]]
-      ##closest_y = self.y_train[np.argsort(dists[i,:])[:k]]
-
-      # print index_of_smallest_k
-      # print 'IOSK', index_of_smallest_k.shape
-
-      u, indices = np.unique(index_of_smallest_k, return_inverse=True)
-      y_pred[i] = u[np.argmax(np.bincount(indices))]
-  ##    closest_y[index_of_smallest_k] += 1
-
-
-      ##u, indices = np.unique(closest_y, return_inverse=True)
-      ##y_pred[i] = u[np.argmax(np.bincount(indices))]
-
-      # for i in xrange(k):     #xrange was without k itself, right?
-      #   # print i
-      #   closest_y[index_of_smallest_k[i]] += 1  #add to the index of the predicted label
-      # print closest_y
-
-      #########################################################################
-      # TODO:                                                                 #
-      # Now that you have found the labels of the k nearest neighbors, you    #
-      # need to find the most common label in the list closest_y of labels.   #
-      # Store this label in y_pred[i]. Break ties by choosing the smaller     #
-      # label.                                                                #
-      #########################################################################
-
-      ##y_pred[i] = np.argmax(closest_y)
-
-      #########################################################################
-      #                           END OF YOUR CODE                            # 
-      #########################################################################
+    #########################################################################
+    # TODO:                                                                 #
+    # Use the distance matrix to find the k nearest neighbors of the ith    #
+    # testing point, and use self.y_train to find the labels of these       #
+    # neighbors. Store these labels in closest_y.                           #
+    # Hint: Look up the function numpy.argsort.                             #
+    #########################################################################
+    # A partial sort is enough: we only need the k smallest distances of
+    # each row, not their order.
+    k = min(k, dists.shape[1])
+    closest_idx = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    closest_y = self.y_train[closest_idx]
+    #########################################################################
+    # TODO:                                                                 #
+    # Now that you have found the labels of the k nearest neighbors, you    #
+    # need to find the most common label in the list closest_y of labels.   #
+    # Store this label in y_pred[i]. Break ties by choosing the smaller     #
+    # label.                                                                #
+    #########################################################################
+    y_pred = self._vote(closest_y)
+    #########################################################################
+    #                           END OF YOUR CODE                            # 
+    #########################################################################
 
     return y_pred
-
@@ -1,21 +1,49 @@
+import functools
+import hashlib
 import matplotlib
+import multiprocessing
 import numpy as np
+import os
+import tempfile
+import types
 from scipy.ndimage import uniform_filter
 
 
-def extract_features(imgs, feature_fns, verbose=False):
+def extract_features(imgs, feature_fns, verbose=False, chunk_size=1000,
+                     n_jobs=1, dtype=np.float64, out_path=None, cache_dir=None):
   """
   Given pixel data for images and several feature functions that can operate on
   single images, apply all feature functions to all images, concatenating the
   feature vectors for each image and storing the features for all images in
   a single matrix.
 
+  Images are processed in chunks of chunk_size images. With n_jobs > 1 the
+  chunks are spread over a pool of worker processes that write their results
+  straight into a memory-mapped .npy file, so no feature arrays are sent back
+  to the parent process. The workers inherit imgs and feature_fns when they are
+  forked, so lambdas work as feature functions.
+
   Inputs:
   - imgs: N x H X W X C array of pixel data for N images.
   - feature_fns: List of k feature functions. The ith feature function should
     take as input an H x W x D array and return a (one-dimensional) array of
-    length F_i.
+    length F_i. Feature functions with a true `batched` attribute (such as
+    hog_features) instead take a whole M x H x W x D stack of images and
+    return an M x F_i array.
   - verbose: Boolean; if true, print progress.
+  - chunk_size: Number of images processed at once.
+  - n_jobs: Number of worker processes; -1 uses one per CPU.
+  - dtype: numpy datatype of the returned features.
+  - out_path: If given, the features are written to a .npy file at this path
+    and returned as a read-write memmap of it. Parallel extraction without an
+    out_path uses a temporary file that is deleted once it is mapped.
+  - cache_dir: If given, features are cached in this directory as .npy files
+    keyed by a hash of imgs, of the feature functions and of dtype. A cache hit
+    returns a copy-on-write memmap of the cached file without computing
+    anything; out_path is ignored when caching. Feature function parameters
+    are part of the key when they are given through functools.partial,
+    default arguments, closures or plain global constants (like nbin in the
+    lambda used in features.py).
 
   Returns:
   An array of shape (N, F_1 + ... + F_k) where each column is the concatenation
@@ -25,34 +53,193 @@ def extract_features(imgs, feature_fns, verbose=False):
   if num_images == 0:
     return np.array([])
 
+  if cache_dir is not None:
+    key = _features_cache_key(imgs, feature_fns, dtype)
+    cache_path = os.path.join(cache_dir, 'features_%s.npy' % key)
+    if os.path.isfile(cache_path):
+      if verbose:
+        print 'Loading cached features from %s' % cache_path
+      return np.load(cache_path, mmap_mode='c')
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    # Write to a temporary name first so that an interrupted run never leaves
+    # a truncated file behind under the real key.
+    fd, partial_path = tempfile.mkstemp(suffix='.npy', dir=cache_dir)
+    os.close(fd)
+    try:
+      imgs_features = extract_features(imgs, feature_fns, verbose=verbose,
+                                       chunk_size=chunk_size, n_jobs=n_jobs,
+                                       dtype=dtype, out_path=partial_path)
+      imgs_features.flush()
+      del imgs_features
+      os.rename(partial_path, cache_path)
+    finally:
+      if os.path.exists(partial_path):
+        os.remove(partial_path)
+    return np.load(cache_path, mmap_mode='c')
+  if n_jobs == -1:
+    n_jobs = multiprocessing.cpu_count()
+
   # Use the first image to determine feature dimensions
   feature_dims = []
-  first_image_features = []
   for feature_fn in feature_fns:
-    feats = feature_fn(imgs[0].squeeze())
+    if _is_batched(feature_fn):
+      feats = feature_fn(imgs[:1])[0]
+    else:
+      feats = feature_fn(imgs[0].squeeze())
     assert len(feats.shape) == 1, 'Feature functions must be one-dimensional'
     feature_dims.append(feats.size)
-    first_image_features.append(feats)
 
   # Now that we know the dimensions of the features, we can allocate a single
   # big array to store all features as columns.
   total_feature_dim = sum(feature_dims)
-  imgs_features = np.zeros((num_images, total_feature_dim))
-  imgs_features[0] = np.hstack(first_image_features).T
-
-  # Extract features for the rest of the images.
-  for i in xrange(1, num_images):
-    idx = 0
-    for feature_fn, feature_dim in zip(feature_fns, feature_dims):
-      next_idx = idx + feature_dim
-      imgs_features[i, idx:next_idx] = feature_fn(imgs[i].squeeze())
-      idx = next_idx
-    if verbose and i % 1000 == 0:
-      print 'Done extracting features for %d / %d images' % (i, num_images)
+  shape = (num_images, total_feature_dim)
+  temp_path = None
+  if out_path is None and n_jobs > 1:
+    fd, temp_path = tempfile.mkstemp(suffix='.npy')
+    os.close(fd)
+    out_path = temp_path
+  if out_path is None:
+    imgs_features = np.zeros(shape, dtype=dtype)
+  else:
+    imgs_features = np.lib.format.open_memmap(out_path, mode='w+',
+                                               dtype=dtype, shape=shape)
+
+  chunks = [(start, min(start + chunk_size, num_images))
+            for start in xrange(0, num_images, chunk_size)]
+  if n_jobs > 1:
+    # Forked workers see this state without it being pickled
+    global _worker_state
+    imgs_features.flush()
+    _worker_state = (imgs, feature_fns, feature_dims, out_path)
+    pool = multiprocessing.Pool(n_jobs)
+    try:
+      done = pool.imap_unordered(_extract_features_worker, chunks)
+      for i, _ in enumerate(done):
+        if verbose:
+          print 'Done extracting features for chunk %d / %d' % (i + 1, len(chunks))
+    finally:
+      pool.terminate()
+      pool.join()
+      _worker_state = None
+      if temp_path is not None:
+        # The parent's mapping stays valid after the file is unlinked
+        os.remove(temp_path)
+  else:
+    for start, end in chunks:
+      _extract_features_chunk(imgs[start:end], feature_fns, feature_dims,
+                              imgs_features[start:end])
+      if verbose:
+        print 'Done extracting features for %d / %d images' % (end, num_images)
 
   return imgs_features
 
 
+_worker_state = None
+
+
+def _extract_features_worker(chunk):
+  """
+  Extract the features of one (start, end) chunk of images in a worker process
+  started by extract_features, writing them into the shared output file.
+  """
+  imgs, feature_fns, feature_dims, out_path = _worker_state
+  start, end = chunk
+  imgs_features = np.load(out_path, mmap_mode='r+')
+  _extract_features_chunk(imgs[start:end], feature_fns, feature_dims,
+                          imgs_features[start:end])
+  imgs_features.flush()
+  return end
+
+
+def _extract_features_chunk(imgs, feature_fns, feature_dims, out):
+  """
+  Apply all feature functions to a chunk of images, storing the concatenated
+  features of imgs[i] in out[i].
+  """
+  idx = 0
+  for feature_fn, feature_dim in zip(feature_fns, feature_dims):
+    next_idx = idx + feature_dim
+    if _is_batched(feature_fn):
+      out[:, idx:next_idx] = feature_fn(imgs)
+    else:
+      for i in xrange(imgs.shape[0]):
+        out[i, idx:next_idx] = feature_fn(imgs[i].squeeze())
+    idx = next_idx
+
+
+def _features_cache_key(imgs, feature_fns, dtype, chunk_size=1000):
+  """
+  Hash the pixel data of imgs together with fingerprints of the feature
+  functions and the output dtype, for use as a feature cache key.
+  """
+  h = hashlib.md5()
+  h.update(repr((imgs.shape, imgs.dtype.str, np.dtype(dtype).str)))
+  for feature_fn in feature_fns:
+    h.update(repr(_fingerprint(feature_fn)))
+  for start in xrange(0, imgs.shape[0], chunk_size):
+    h.update(np.ascontiguousarray(imgs[start:start + chunk_size]).data)
+  return h.hexdigest()
+
+
+def _fingerprint(fn, seen=None):
+  """
+  Summarize a feature function and its parameters as a nested tuple of plain
+  values that does not change between runs.
+
+  This covers functools.partial arguments, default arguments, closure
+  variables and global constants used by the function. Other functions from
+  this package (or from the same module) that it calls are included
+  recursively, so editing their code also changes the fingerprint.
+  """
+  if seen is None:
+    seen = set()
+  if isinstance(fn, functools.partial):
+    return ('partial', _fingerprint(fn.func, seen), repr(fn.args),
+            repr(sorted((fn.keywords or {}).items())))
+  code = getattr(fn, '__code__', None)
+  if code is None:
+    # Builtins, ufuncs and other callables without Python bytecode
+    return ('callable', getattr(fn, '__module__', None),
+            getattr(fn, '__name__', repr(type(fn))))
+  if fn in seen:
+    return ('function', fn.__module__, fn.__name__)
+  seen.add(fn)
+
+  module = fn.__module__
+  referenced = []
+  for name in code.co_names:
+    value = fn.__globals__.get(name)
+    if isinstance(value, (bool, int, long, float, basestring, tuple)):
+      referenced.append((name, repr(value)))
+    elif isinstance(value, types.FunctionType):
+      value_module = value.__module__ or ''
+      if (value_module == module or
+          value_module.split('.')[0] == __name__.split('.')[0]):
+        referenced.append((name, _fingerprint(value, seen)))
+  closure = [repr(cell.cell_contents) for cell in (fn.__closure__ or ())]
+  return ('function', module, fn.__name__, _code_fingerprint(code),
+          repr(fn.__defaults__), tuple(referenced), tuple(closure))
+
+
+def _code_fingerprint(code):
+  """
+  Bytecode and constants of a code object, recursing into nested code objects
+  (whose repr would contain a memory address).
+  """
+  consts = tuple(_code_fingerprint(c) if isinstance(c, types.CodeType)
+                 else repr(c) for c in code.co_consts)
+  return (code.co_code, consts, code.co_names)
+
+
+def _is_batched(feature_fn):
+  """
+  Check whether a feature function operates on whole stacks of images. This
+  looks through functools.partial wrappers.
+  """
+  return getattr(getattr(feature_fn, 'func', feature_fn), 'batched', False)
+
+
 def rgb2gray(rgb):
   """Convert RGB image to grayscale
 
@@ -120,6 +307,93 @@ def hog_feature(im):
   return orientation_histogram.ravel()
 
 
+def hog_features(imgs):
+  """Compute Histogram of Gradient (HOG) features for a stack of images
+
+     Batched version of hog_feature: the gradients, orientation bins and cell
+     sums of all images are computed at once, with a single histogram pass
+     over every pixel of the stack instead of one filtering pass per
+     orientation and image. The result matches hog_feature up to floating
+     point rounding.
+
+    Parameters:
+      imgs : N x H x W x C array of rgb images, or N x H x W array of
+        grayscale images
+
+    Returns:
+      feats: N x F array where feats[i] is the HOG feature of imgs[i]
+
+  """
+
+  # convert rgb to grayscale if needed
+  if imgs.ndim == 4 and imgs.shape[3] == 1:
+    images = imgs[:, :, :, 0]
+  elif imgs.ndim == 4:
+    # Same as rgb2gray, but as one matrix-vector product over all pixels
+    rgb = np.ascontiguousarray(imgs[..., :3]).reshape(-1, 3)
+    images = rgb.dot([0.299, 0.587, 0.144]).reshape(imgs.shape[:3])
+  else:
+    images = imgs
+
+  N, sx, sy = images.shape # number of images and image size
+  orientations = 9 # number of gradient bins
+  cx, cy = (8, 8) # pixels per cell
+
+  n_cellsx = int(np.floor(sx / cx))  # number of cells in x
+  n_cellsy = int(np.floor(sy / cy))  # number of cells in y
+
+  # Same arithmetic as hog_feature, done in place on the whole stack
+  gx = np.zeros(images.shape)
+  gy = np.zeros(images.shape)
+  np.subtract(images[:, :, 1:], images[:, :, :-1], out=gx[:, :, :-1]) # compute gradient on x-direction
+  np.subtract(images[:, 1:, :], images[:, :-1, :], out=gy[:, :-1, :]) # compute gradient on y-direction
+  gx = gx[:, :n_cellsx * cx, :n_cellsy * cy]
+  gy = gy[:, :n_cellsx * cx, :n_cellsy * cy]
+  grad_mag = gx * gx
+  grad_mag += gy * gy
+  np.sqrt(grad_mag, out=grad_mag) # gradient magnitude
+  gx += 1e-15
+  grad_ori = np.arctan2(gy, gx)
+  grad_ori *= 180 / np.pi
+  grad_ori += 90 # gradient orientation
+
+  # Orientation bin i holds bin_width * i <= ori < bin_width * (i + 1). The
+  # division can only round up onto a bin edge, which the exact comparison
+  # made by hog_feature undoes. As in hog_feature, orientations that are not
+  # strictly positive are dropped.
+  bin_width = 180 / orientations
+  ori_bin = np.floor(grad_ori / bin_width)
+  ori_bin -= grad_ori < ori_bin * bin_width
+  grad_mag *= grad_ori > 0
+
+  # Orientations lie in [-90, 270], i.e. in bins -bin_offset .. 270 / bin_width.
+  # Every cell gets room for all of them; the bins outside 0 .. orientations - 1
+  # are dropped after counting.
+  bin_offset = -int(np.floor(-90.0 / bin_width))
+  cell_bins = bin_offset + 270 / bin_width + 1
+
+  # Flat index of the (image, cell, orientation) bin of every pixel. Cells are
+  # laid out column-major to match the transpose in hog_feature.
+  image_idx = np.arange(N)[:, np.newaxis, np.newaxis]
+  row_cell = (np.arange(n_cellsx * cx) / cx)[np.newaxis, :, np.newaxis]
+  col_cell = (np.arange(n_cellsy * cy) / cy)[np.newaxis, np.newaxis, :]
+  cell_idx = (image_idx * n_cellsy + col_cell) * n_cellsx + row_cell
+  bin_idx = ori_bin.astype(np.intp)
+  bin_idx += cell_idx * cell_bins + bin_offset
+
+  num_bins = N * n_cellsy * n_cellsx * cell_bins
+  orientation_histogram = np.bincount(bin_idx.ravel(), weights=grad_mag.ravel(),
+                                      minlength=num_bins)
+  orientation_histogram = orientation_histogram.reshape(N, -1, cell_bins)
+  orientation_histogram = orientation_histogram[:, :, bin_offset:bin_offset + orientations]
+  # hog_feature averages over each cell
+  orientation_histogram /= cx * cy
+
+  return orientation_histogram.reshape(N, -1)
+
+hog_features.batched = True
+
+
 def color_histogram_hsv(im, nbin=10, xmin=0, xmax=255, normalized=True):
   """
   Compute color histogram for an image using hue.
@@ -145,4 +419,59 @@ def color_histogram_hsv(im, nbin=10, xmin=0, xmax=255, normalized=True):
   return imhist
 
 
+def color_histograms_hsv(imgs, nbin=10, xmin=0, xmax=255, normalized=True):
+  """
+  Compute hue color histograms for a whole stack of images at once.
+
+  This is a vectorized version of color_histogram_hsv: the hue of every pixel
+  is computed the same way matplotlib.colors.rgb_to_hsv does it, and all of
+  the histograms are counted with a single bincount, offsetting the bin index
+  of each image by nbin times its position in the stack.
+
+  Inputs:
+  - imgs: N x H x W x C array of pixel data for N RGB images.
+  - nbin: Number of histogram bins. (default: 10)
+  - xmin: Minimum pixel value (default: 0)
+  - xmax: Maximum pixel value (default: 255)
+  - normalized: Whether to normalize the histograms (default: True)
+
+  Returns:
+    Array of shape N x nbin where row i is color_histogram_hsv(imgs[i]).
+  """
+  N = imgs.shape[0]
+  bins = np.linspace(xmin, xmax, nbin+1)
+
+  # Hue, following rgb_to_hsv: which channel holds the max picks the sextant,
+  # with blue taking precedence over green over red on ties.
+  rgb = imgs / xmax
+  rgb = rgb.astype(np.promote_types(rgb.dtype, np.float32), copy=False)
+  r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+  arr_max = np.maximum(np.maximum(r, g), b)
+  delta = arr_max - np.minimum(np.minimum(r, g), b)
+  ipos = delta > 0
+  delta[~ipos] = 1
+  hue = np.where(b == arr_max, 4. + (r - g) / delta,
+                 np.where(g == arr_max, 2. + (b - r) / delta, (g - b) / delta))
+  hue[~ipos] = 0
+  hue = (hue / 6.0) % 1.0
+  hue *= xmax
+
+  # Bin index of every pixel with the same edge rules as np.histogram: bins
+  # are half open except for the last one, values out of range are dropped.
+  hue = hue.reshape(N, -1)
+  idx = np.searchsorted(bins, hue, side='right') - 1
+  idx[hue == bins[-1]] = nbin - 1
+  valid = (idx >= 0) & (idx < nbin)
+  idx[~valid] = 0
+  idx += nbin * np.arange(N)[:, np.newaxis]
+  counts = np.bincount(idx.ravel(), weights=valid.ravel(), minlength=N * nbin)
+  counts = counts.reshape(N, nbin)
+
+  db = np.diff(bins)
+  if normalized:
+    counts = counts / db / counts.sum(axis=1, keepdims=True)
+  return counts * db
+color_histograms_hsv.batched = True
+
+
 pass
@@ -12,7 +12,8 @@ plt.rcParams['image.cmap'] = 'gray'
 # %load_ext autoreload
 # %autoreload 2
 
-from cs231n.features import color_histogram_hsv, hog_feature
+import functools
+from cs231n.features import color_histograms_hsv, hog_features
 
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000):
   # Load the raw CIFAR-10 data
@@ -37,10 +38,14 @@ X_train, y_train, X_val, y_val, X_test, y_test = get_CIFAR10_data()
 from cs231n.features import *
 
 num_color_bins = 10 # Number of bins in the color histogram
-feature_fns = [hog_feature, lambda img: color_histogram_hsv(img, nbin=num_color_bins)]
-X_train_feats = extract_features(X_train, feature_fns, verbose=True)
-X_val_feats = extract_features(X_val, feature_fns)
-X_test_feats = extract_features(X_test, feature_fns)
+feature_fns = [hog_features,
+               functools.partial(color_histograms_hsv, nbin=num_color_bins)]
+# Features are cached on disk, so re-running this script skips the extraction
+feature_cache_dir = 'cs231n/datasets/feature_cache'
+X_train_feats = extract_features(X_train, feature_fns, verbose=True,
+                                 cache_dir=feature_cache_dir)
+X_val_feats = extract_features(X_val, feature_fns, cache_dir=feature_cache_dir)
+X_test_feats = extract_features(X_test, feature_fns, cache_dir=feature_cache_dir)
 
 # Preprocessing: Subtract the mean feature
 mean_feat = np.mean(X_train_feats, axis=0, keepdims=True)
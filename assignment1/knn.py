@@ -186,39 +186,11 @@ k_to_accuracies = {}
 # last fold as a validation set. Store the accuracies for all fold and all     #
 # values of k in the k_to_accuracies dictionary.                               #
 ################################################################################
-for id, k in enumerate(k_choices):
-
-    k_to_accuracies[k] = []
-
-    for i in xrange(num_folds):
-        #Slecting the cross validation validation set
-        X_cv = X_train_folds[i]
-        y_cv = y_train_folds[i]
-
-        #Slecting the cross validation training set
-        # X_tr = np.concatenate((np.array(X_train_folds)[1:i,:], np.array(X_train_folds)[i+1:,:]))
-        # y_tr = np.concatenate((np.array(y_train_folds)[1:i,:], np.array(y_train_folds)[i+1:,:]))
-        X_tr = np.concatenate(tuple([X_train_folds[i] for q in range(num_folds) if i!=q]))
-        y_tr = np.concatenate(tuple([y_train_folds[i] for q in range(num_folds) if i!=q]))
-
-        # print 'X_tr', X_tr.shape
-        # print 'y_tr', y_tr.shape
-        # print 'X_cv', X_cv.shape
-        # print 'y_cv', y_cv.shape
-
-        classifier = KNearestNeighbor()
-        classifier.train(X_tr, y_tr) #train on training folds
-
-        dists = classifier.compute_distances_no_loops(X_cv)             #test on cross validation folds
-        y_test_pred = classifier.predict_labels(dists, k=k)
-        num_correct = np.sum(y_test_pred == y_cv)
-        num_samples = X_tr.shape[0]
-
-        # print num_correct
-        if k not in k_to_accuracies:
-            k_to_accuracies[k] = [float(num_correct) / num_samples]
-        else:
-            k_to_accuracies[k].append(float(num_correct) / num_samples)
+# Each block of fold-to-fold distances is computed once and reused for every
+# value of k, instead of recomputing all distances for every (fold, k) pair.
+classifier = KNearestNeighbor()
+k_to_accuracies = classifier.cross_validate(X_train, y_train, k_choices,
+                                            num_folds=num_folds)
 
 ################################################################################
 #                                 END OF YOUR CODE                             #
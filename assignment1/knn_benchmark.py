@@ -0,0 +1,66 @@
+import functools
+import time
+import numpy as np
+from cs231n.data_utils import load_CIFAR10
+from cs231n.features import color_histograms_hsv, hog_features, extract_features
+from cs231n.classifiers import KNearestNeighbor
+
+# Compare the approximate (IVF) nearest neighbor index of KNearestNeighbor
+# against exact brute-force search, both on raw CIFAR-10 pixels and on the
+# HOG + color histogram features used in features.py.
+
+num_training = 49000
+num_test = 1000
+k = 10
+num_cells = 100
+probe_choices = [1, 2, 4, 8, 16]
+
+cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
+X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+X_train = X_train[:num_training]
+y_train = y_train[:num_training]
+X_test = X_test[:num_test]
+y_test = y_test[:num_test]
+
+num_color_bins = 10 # Number of bins in the color histogram
+feature_fns = [hog_features,
+               functools.partial(color_histograms_hsv, nbin=num_color_bins)]
+X_train_feats = extract_features(X_train, feature_fns, verbose=True)
+X_test_feats = extract_features(X_test, feature_fns)
+mean_feat = np.mean(X_train_feats, axis=0, keepdims=True)
+std_feat = np.std(X_train_feats, axis=0, keepdims=True)
+X_train_feats = (X_train_feats - mean_feat) / std_feat
+X_test_feats = (X_test_feats - mean_feat) / std_feat
+
+datasets = [
+  ('pixels', np.reshape(X_train, (num_training, -1)),
+             np.reshape(X_test, (num_test, -1))),
+  ('hog+hsv', X_train_feats, X_test_feats),
+]
+
+def recall_at_k(approx_idx, exact_idx):
+  """
+  Fraction of the exact k nearest neighbors that the approximate search found.
+  """
+  hits = [np.intersect1d(a, e).size for a, e in zip(approx_idx, exact_idx)]
+  return float(np.sum(hits)) / exact_idx.size
+
+for name, X_tr, X_te in datasets:
+  classifier = KNearestNeighbor()
+  tic = time.time()
+  classifier.train(X_tr, y_train, num_cells=num_cells)
+  print '%s: built index with %d cells in %fs' % (name, num_cells, time.time() - tic)
+
+  tic = time.time()
+  dists = classifier.compute_distances_no_loops(X_te)
+  exact_idx = np.argsort(dists, axis=1)[:, :k]
+  exact_time = time.time() - tic
+  print '%s: exact search, %f queries/sec' % (name, num_test / exact_time)
+
+  for num_probes in probe_choices:
+    tic = time.time()
+    approx_idx = classifier.compute_nearest_index(X_te, k, num_probes)
+    approx_time = time.time() - tic
+    print '%s: %d probes, recall@%d = %f, %f queries/sec' % (
+          name, num_probes, k, recall_at_k(approx_idx, exact_idx),
+          num_test / approx_time)
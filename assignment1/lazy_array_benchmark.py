@@ -0,0 +1,45 @@
+import time
+import numpy as np
+from cs231n.data_utils import LazyFloatArray
+
+# Check that a LazyFloatArray over uint8 images gives the same values as the
+# float array it stands for, with and without a mean image to subtract: whole
+# array operations such as np.mean(X, axis=0), and the minibatches a Solver
+# indexes out of it. Then compare the time to get one minibatch from it
+# against converting the whole array to float.
+
+num_images = 10000
+batch_size = 200
+image_shape = (3, 32, 32)
+
+def rel_error(x, y):
+  """ returns relative error """
+  return np.max(np.abs(x - y) / (np.maximum(1e-8, np.abs(x) + np.abs(y))))
+
+data = np.random.randint(256, size=(num_images,) + image_shape).astype(np.uint8)
+mean_image = np.mean(data, axis=0).astype(np.float32)
+batch_mask = np.random.choice(num_images, batch_size)
+
+for name, mean in [('no mean', None), ('mean image', mean_image)]:
+  X = LazyFloatArray(data, np.float32, mean)
+  X_eager = data.astype(np.float32)
+  if mean is not None:
+    X_eager -= mean
+
+  print name
+  print '  np.mean error: %e' % rel_error(np.mean(X, axis=0),
+                                         np.mean(X_eager, axis=0))
+  print '  np.reshape error: %e' % rel_error(
+        np.reshape(X, (num_images, -1)), np.reshape(X_eager, (num_images, -1)))
+  print '  X[batch_mask] error: %e' % rel_error(X[batch_mask],
+                                               X_eager[batch_mask])
+  print '  X[start:end] error: %e' % rel_error(X[100:100 + batch_size],
+                                              X_eager[100:100 + batch_size])
+
+  tic = time.time()
+  X[batch_mask]
+  batch_time = time.time() - tic
+  tic = time.time()
+  np.asarray(X)
+  full_time = time.time() - tic
+  print '  minibatch %.4fs, whole array %.4fs' % (batch_time, full_time)
@@ -0,0 +1,50 @@
+import time
+import numpy as np
+from cs231n.layers import batchnorm_forward, batchnorm_backward
+from cs231n.layers import batchnorm_backward_alt
+
+# Time the batchnorm forward pass and the two backward passes (the staged
+# computation graph of batchnorm_backward and the closed form of
+# batchnorm_backward_alt) on a wide fully-connected layer, and measure how
+# much memory the forward pass keeps in its cache.
+
+N, D = 256, 4096
+num_repeats = 5
+
+x = 3 * np.random.randn(N, D) + 1
+gamma, beta = np.random.randn(D), np.random.randn(D)
+dout = np.random.randn(N, D)
+
+def best_time(f, *args):
+  """
+  Smallest wall clock time of num_repeats calls of f(*args), and its result.
+  """
+  times = []
+  for _ in xrange(num_repeats):
+    tic = time.time()
+    result = f(*args)
+    times.append(time.time() - tic)
+  return min(times), result
+
+def cache_bytes(cache):
+  """ Number of bytes held by the arrays in a cache """
+  return sum(v.nbytes for v in cache if isinstance(v, np.ndarray))
+
+def rel_error(x, y):
+  """ returns relative error """
+  return np.max(np.abs(x - y) / (np.maximum(1e-8, np.abs(x) + np.abs(y))))
+
+forward_time, (out, cache) = best_time(batchnorm_forward, x, gamma, beta,
+                                       {'mode': 'train'})
+staged_time, staged_grads = best_time(batchnorm_backward, dout, cache)
+fused_time, fused_grads = best_time(batchnorm_backward_alt, dout, cache)
+
+print 'N = %d, D = %d, best of %d runs' % (N, D, num_repeats)
+print 'cache: %.1f MB, %.2f times the size of x' % (
+      cache_bytes(cache) / 1e6, float(cache_bytes(cache)) / x.nbytes)
+print 'forward: %.4fs' % forward_time
+print 'backward, staged: %.4fs' % staged_time
+print 'backward, closed form: %.4fs (%.2fx faster)' % (
+      fused_time, staged_time / fused_time)
+for name, g1, g2 in zip(['dx', 'dgamma', 'dbeta'], staged_grads, fused_grads):
+  print '%s difference: %e' % (name, rel_error(g1, g2))
@@ -1,7 +1,36 @@
+from collections import OrderedDict
 import numpy as np
 
 
+# The indices built by get_im2col_indices for the last few image shapes and
+# field sizes it was called with, least recently used first.
+_im2col_indices_cache = OrderedDict()
+im2col_indices_cache_size = 32
+
+
 def get_im2col_indices(x_shape, field_height, field_width, padding=1, stride=1):
+  """
+  Get the (k, i, j) indices such that x_padded[:, k, i, j] holds the columns
+  of im2col_indices. The indices do not depend on the batch size, and are kept
+  in a cache of the im2col_indices_cache_size most recently used ones; they are
+  read-only since the cached arrays are shared.
+  """
+  N, C, H, W = x_shape
+  key = (C, H, W, field_height, field_width, padding, stride)
+  if key in _im2col_indices_cache:
+    indices = _im2col_indices_cache.pop(key)
+  else:
+    indices = _build_im2col_indices(x_shape, field_height, field_width,
+                                    padding, stride)
+    for index in indices:
+      index.setflags(write=False)
+  _im2col_indices_cache[key] = indices
+  while len(_im2col_indices_cache) > im2col_indices_cache_size:
+    _im2col_indices_cache.popitem(last=False)
+  return indices
+
+
+def _build_im2col_indices(x_shape, field_height, field_width, padding, stride):
   # First figure out what the size of the output should be
   N, C, H, W = x_shape
   assert (H + 2 * padding - field_height) % stride == 0
@@ -39,17 +68,89 @@ def im2col_indices(x, field_height, field_width, padding=1, stride=1):
 
 def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
                    stride=1):
-  """ An implementation of col2im based on fancy indexing and np.add.at """
+  """
+  An implementation of col2im for the columns of im2col_indices. Those have
+  the same layout as the columns of im2col_strides, so rather than scattering
+  single elements with np.add.at this adds the block of columns of each kernel
+  offset to a strided slice of the padded image, with col2im_strides.
+  """
   N, C, H, W = x_shape
+  return col2im_strides(cols, N, C, H, W, field_height, field_width, padding,
+                        stride)
+
+
+def im2col_strides(x, field_height, field_width, padding, stride):
+  """
+  An implementation of im2col based on as_strided, with the same arguments
+  and output layout as im2col_cython: row (c, i, j) and column (y, x, n) of
+  cols hold x_padded[n, c, stride * y + i, stride * x + j].
+  """
+  N, C, H, W = x.shape
+  out_height = (H + 2 * padding - field_height) / stride + 1
+  out_width = (W + 2 * padding - field_width) / stride + 1
+
+  p = padding
+  x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
   H_padded, W_padded = H + 2 * padding, W + 2 * padding
-  x_padded = np.zeros((N, C, H_padded, W_padded), dtype=cols.dtype)
-  k, i, j = get_im2col_indices(x_shape, field_height, field_width, padding,
-                               stride)
-  cols_reshaped = cols.reshape(C * field_height * field_width, -1, N)
-  cols_reshaped = cols_reshaped.transpose(2, 0, 1)
-  np.add.at(x_padded, (slice(None), k, i, j), cols_reshaped)
-  if padding == 0:
-    return x_padded
-  return x_padded[:, :, padding:-padding, padding:-padding]
+
+  shape = (C, field_height, field_width, out_height, out_width, N)
+  strides = (H_padded * W_padded, W_padded, 1, stride * W_padded, stride,
+             C * H_padded * W_padded)
+  strides = x_padded.itemsize * np.array(strides)
+  x_stride = np.lib.stride_tricks.as_strided(x_padded, shape=shape,
+                                             strides=strides)
+  cols = np.ascontiguousarray(x_stride)
+  cols.shape = (C * field_height * field_width, -1)
+  return cols
+
+
+def col2im_strides(cols, N, C, H, W, field_height, field_width, padding,
+                   stride):
+  """
+  The inverse of im2col_strides, with the same arguments as col2im_cython.
+
+  Rather than scattering single elements, this loops over the
+  field_height * field_width kernel offsets and adds the whole block of
+  columns for each offset to a strided slice of the padded image.
+  """
+  out_height = (H + 2 * padding - field_height) / stride + 1
+  out_width = (W + 2 * padding - field_width) / stride + 1
+  H_padded, W_padded = H + 2 * padding, W + 2 * padding
+
+  cols = cols.reshape(C, field_height, field_width, out_height, out_width, N)
+  # Accumulate in (C, H, W, N) order so that the slices we add to have the
+  # same memory layout as the blocks of cols.
+  x_padded = np.zeros((C, H_padded, W_padded, N), dtype=cols.dtype)
+  for i in xrange(field_height):
+    i_max = i + stride * out_height
+    for j in xrange(field_width):
+      j_max = j + stride * out_width
+      x_padded[:, i:i_max:stride, j:j_max:stride, :] += cols[:, i, j]
+  x_padded = x_padded.transpose(3, 0, 1, 2)
+  return x_padded[:, :, padding:padding + H, padding:padding + W]
+
+
+def col2im_6d_strides(cols, N, C, H, W, HH, WW, pad, stride, x_padded=None):
+  """
+  The inverse of the as_strided im2col in conv_forward_strides, with the same
+  arguments as col2im_6d_cython: cols has shape (C, HH, WW, N, out_h, out_w).
+
+  The sums are accumulated in x_padded, an array of shape
+  (C, N, H + 2 * pad, W + 2 * pad) that is zeroed first, if it is given.
+  """
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+
+  if x_padded is None:
+    x_padded = np.zeros((C, N, H + 2 * pad, W + 2 * pad), dtype=cols.dtype)
+  else:
+    x_padded.fill(0)
+  for hh in xrange(HH):
+    h_max = hh + stride * out_h
+    for ww in xrange(WW):
+      w_max = ww + stride * out_w
+      x_padded[:, :, hh:h_max:stride, ww:w_max:stride] += cols[:, hh, ww]
+  x_padded = x_padded.transpose(1, 0, 2, 3)
+  return x_padded[:, :, pad:pad + H, pad:pad + W]
 
 pass
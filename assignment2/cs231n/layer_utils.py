@@ -68,16 +68,25 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
   Inputs:
   - x: Input to the convolutional layer
   - w, b, conv_param: Weights and parameters for the convolutional layer
-  - pool_param: Parameters for the pooling layer
+  - pool_param: Parameters for the pooling layer. The pooling layer always
+    uses the layout ('NCHW' or 'NHWC') given in conv_param.
+
+  In the NCHW layout this uses conv_relu_pool_forward_fused, which does the
+  three layers in one pass without keeping their intermediate outputs.
 
   Returns a tuple of:
   - out: Output from the pooling layer
   - cache: Object to give to the backward pass
   """
+  if conv_param.get('layout', 'NCHW') == 'NCHW':
+    out, fused_cache = conv_relu_pool_forward_fused(x, w, b, conv_param,
+                                                    pool_param)
+    return out, ('fused', fused_cache)
+  pool_param = dict(pool_param, layout=conv_param.get('layout', 'NCHW'))
   a, conv_cache = conv_forward_fast(x, w, b, conv_param)
   s, relu_cache = relu_forward(a)
   out, pool_cache = max_pool_forward_fast(s, pool_param)
-  cache = (conv_cache, relu_cache, pool_cache)
+  cache = ('layers', (conv_cache, relu_cache, pool_cache))
   return out, cache
 
 
@@ -85,7 +94,10 @@ def conv_relu_pool_backward(dout, cache):
   """
   Backward pass for the conv-relu-pool convenience layer
   """
-  conv_cache, relu_cache, pool_cache = cache
+  method, real_cache = cache
+  if method == 'fused':
+    return conv_relu_pool_backward_fused(dout, real_cache)
+  conv_cache, relu_cache, pool_cache = real_cache
   ds = max_pool_backward_fast(dout, pool_cache)
   da = relu_backward(ds, relu_cache)
   dx, dw, db = conv_backward_fast(da, conv_cache)
@@ -185,24 +185,21 @@ def batchnorm_forward(x, gamma, beta, bn_param):
     # storing your result in the running_mean and running_var variables.        #
     #############################################################################
 
-    #Calculating the mean
-    mean = (1.0/N) * np.sum(x, axis=0)
+    # The centered data is normalized in place to give x_hat, and the variance
+    # is reduced from it without squaring into a temporary.
+    mean = x.mean(axis=0)
+    x_hat = x - mean
+    variance = np.einsum('ij,ij->j', x_hat, x_hat) / N
+    inv_std = 1.0 / np.sqrt(variance + eps)
+    x_hat *= inv_std
 
-    #Calculating the variance
-    upper = x - mean
-    variance = (1.0/N) * np.sum(upper**2, axis=0)
+    out = gamma * x_hat
+    out += beta
 
-    #Calculating x_hat
-    lower = np.sqrt(variance + eps)
-    x_hat = upper / lower
-
-    #Calculating the output value
-    out = gamma * x_hat + beta
-
-    #outputting now
     running_mean = momentum * running_mean + (1.0 - momentum) * mean
     running_var = momentum * running_var + (1.0 - momentum) * variance
-    cache = (mean, variance, x_hat, upper, lower, gamma, beta, x, bn_param)      #I don't think that we necessarily need all these values
+    # x_hat is the only cached array the size of the input
+    cache = (mode, x_hat, gamma, inv_std)
     #############################################################################
     #                             END OF YOUR CODE                              #
     #############################################################################
@@ -214,9 +211,10 @@ def batchnorm_forward(x, gamma, beta, bn_param):
     # the out variable.                                                         #
     #############################################################################
 
-    norm_x = (x - running_mean) / np.sqrt(running_var + eps)
-    out = gamma * norm_x + beta
-    cache = (running_mean, running_var, gamma, beta, bn_param)
+    inv_std = 1.0 / np.sqrt(running_var + eps)
+    x_hat = (x - running_mean) * inv_std
+    out = gamma * x_hat + beta
+    cache = (mode, x_hat, gamma, inv_std)
 
     #############################################################################
     #                             END OF YOUR CODE                              #
@@ -249,57 +247,28 @@ def batchnorm_backward(dout, cache):
   - dbeta: Gradient with respect to shift parameter beta, of shape (D,)
   """
 
-  #maybe rewrite this with certain conventions...? this is quite messy!
-
-
   dx, dgamma, dbeta = None, None, None
-  #retrieve values from the cache
-  (mean, variance, x_hat, upper, lower, gamma, beta, x, bn_param) = cache
-  eps = bn_param.get('eps', 1e-5)
+  mode, x_hat, gamma, inv_std = cache
   #############################################################################
   # TODO: Implement the backward pass for batch normalization. Store the      #
   # results in the dx, dgamma, and dbeta variables.                           #
   #############################################################################
-
-  # xi = x #... how to address the specific x?
-  # #3.2 backprop level dlowerdx
-  # dlowerdx = 2 * lower * (1-xi)               #xi should be the x we are talking to to....
-  # #3.1 backprop level dupperdx
-  # dupperdx = 1-xi                             #xi should be the x we are talking to to....
-  #
-  # #2. backprop level d(x_hat)dx which is equivalent to d(u/v)dx
-  # dx_hatdx = (dupperdx * lower - upper * dlowerdx) / lower**2       #maybe should store the internal of lower to avoid numerical errors
-  #
-  # #1. backprop level dFdx
-  # dFdx = gamma * dx_hatdx
-
   N, D = dout.shape
 
-  dgamma = np.sum(x_hat * dout, axis=0) #dout * x_hat
+  dgamma = np.sum(x_hat * dout, axis=0)
   dbeta = np.sum(dout, axis=0)
+  dx_hat = gamma * dout
 
-  #calculating these values as described on the paper
-  dl_dxhat = gamma * dout #dout * gamma
-
-  #Everything for dl_dvar:
-  p1 = x-mean
-  p2 = dl_dxhat
-  p3 = (lower**2.0)**(-3.0/2)
-  p4 = (-1.0/2)
-  dl_dvar = np.sum( p1 * p2 * p3 * p4, axis=0)
-
-  #Everything for dl_dmean:
-  q1 = dl_dxhat
-  q2 = (-1.0 / lower)
-  q3 = (1.0/N) * dl_dvar
-  q4 = (-2.0 * (x - mean) )
-  dl_dmean = np.sum(q1 * q2, axis=0) + q3 * np.sum(q4, axis=0)
-
-  #Everything for dl_dx:
-  s1 = dl_dxhat * (1.0 / lower)
-  s2 = dl_dvar * (2.0 / N) * (x - mean)
-  s3 = dl_dmean * (1.0 / N)
-  dl_dx = s1 + s2 + s3
+  if mode == 'train':
+    # x_hat = xc * inv_std, with xc = x - mean and inv_std = (var + eps)^-1/2
+    xc = x_hat / inv_std
+    dinv_std = np.sum(dx_hat * xc, axis=0)
+    dvar = -0.5 * inv_std ** 3 * dinv_std
+    dxc = dx_hat * inv_std + (2.0 / N) * xc * dvar
+    dmean = -np.sum(dxc, axis=0)
+    dl_dx = dxc + dmean / N
+  else:
+    dl_dx = dx_hat * inv_std
 
   #############################################################################
   #                             END OF YOUR CODE                              #
@@ -323,7 +292,7 @@ def batchnorm_backward_alt(dout, cache):
   Inputs / outputs: Same as batchnorm_backward
   """
   dx, dgamma, dbeta = None, None, None
-  (mean, variance, x_hat, upper, lower, gamma, beta, x, bn_param) = cache
+  mode, x_hat, gamma, inv_std = cache
   #############################################################################
   # TODO: Implement the backward pass for batch normalization. Store the      #
   # results in the dx, dgamma, and dbeta variables.                           #
@@ -334,40 +303,22 @@ def batchnorm_backward_alt(dout, cache):
   #############################################################################
   N, D = dout.shape
 
-  dgamma = np.sum(dout * x_hat, axis=0)
-  dbeta = np.sum(dout, axis=0)
-
-  #calculating these values as described on the paper
-  dl_dxhat = dout * gamma
+  dgamma = np.einsum('ij,ij->j', dout, x_hat)
+  dbeta = dout.sum(axis=0)
 
-  #Everything for dl_dvar:
-  p1 = x-mean
-  p2 = dl_dxhat
-  p3 = (lower**2)**(-3.0/2)
-  p4 = (-1.0/2)
-  dl_dvar = np.sum( p1 * p2 * p3 * p4, axis=0)
-
-  #Everything for dl_dmean:
-  q1 = dl_dxhat
-  q2 = (-1.0 / lower)
-  q3 = (1.0/N) * dl_dvar
-  q4 = (-2.0 * (x - mean) )
-  dl_dmean = np.sum(q1 * q2, axis=0) + q3 * np.sum(q4, axis=0)
-
-  #Everything for dl_dx:
-  s1 = dl_dxhat * (1.0 / lower)
-  s2 = dl_dvar * (2.0 / N) * (x - mean)
-  s3 = dl_dmean * (1.0 / N)
-  dl_dx = s1 + s2 + s3
-
-  #############################################################################
-  #                             END OF YOUR CODE                              #
-  #############################################################################
-  dx = dl_dx
+  # dx = gamma * inv_std / N * (N * dout - dbeta - x_hat * dgamma), computed
+  # without any input-sized temporary other than dx
+  if mode == 'train':
+    dx = x_hat * (-dgamma / N)
+    dx += dout
+    dx -= dbeta / N
+  else:
+    dx = dout.copy()
+  dx *= gamma * inv_std
   #############################################################################
   #                             END OF YOUR CODE                              #
   #############################################################################
-  
+
   return dx, dgamma, dbeta
 
 
@@ -384,15 +335,17 @@ def dropout_forward(x, dropout_param):
     - seed: Seed for the random number generator. Passing seed makes this
       function deterministic, which is needed for gradient checking but not in
       real networks.
+    Without a seed, the masks are drawn from a random number generator that
+    is created on first use and kept in dropout_param['rng'], so the global
+    np.random state is never touched.
 
   Outputs:
   - out: Array of the same shape as x.
   - cache: A tuple (dropout_param, mask). In training mode, mask is the dropout
-    mask that was used to multiply the input; in test mode, mask is None.
+    mask that was used to multiply the input, as bits packed with np.packbits;
+    in test mode, mask is None.
   """
   p, mode = dropout_param['p'], dropout_param['mode']
-  if 'seed' in dropout_param:
-    np.random.seed(dropout_param['seed'])
 
   mask = None
   out = None
@@ -402,8 +355,10 @@ def dropout_forward(x, dropout_param):
     # TODO: Implement the training phase forward pass for inverted dropout.   #
     # Store the dropout mask in the mask variable.                            #
     ###########################################################################
-    mask = (np.random.randn(x.shape[0], x.shape[1]) < p) / p
-    out = mask * x
+    keep = _dropout_rng(dropout_param).uniform(size=x.shape) < p
+    out = x * keep
+    out *= 1.0 / p
+    mask = np.packbits(keep)
     ###########################################################################
     #                            END OF YOUR CODE                             #
     ###########################################################################
@@ -432,14 +387,16 @@ def dropout_backward(dout, cache):
   - cache: (dropout_param, mask) from dropout_forward.
   """
   dropout_param, mask = cache
-  mode = dropout_param['mode']
+  p, mode = dropout_param['p'], dropout_param['mode']
   
   dx = None
   if mode == 'train':
     ###########################################################################
     # TODO: Implement the training phase backward pass for inverted dropout.  #
     ###########################################################################
-    dx = dout * mask
+    keep = np.unpackbits(mask)[:dout.size].reshape(dout.shape)
+    dx = dout * keep
+    dx *= 1.0 / p
     ###########################################################################
     #                            END OF YOUR CODE                             #
     ###########################################################################
@@ -448,6 +405,21 @@ def dropout_backward(dout, cache):
   return dx
 
 
+def _dropout_rng(dropout_param):
+  """
+  The random number generator for a dropout layer: a new one seeded with
+  dropout_param['seed'] if there is one, so every call draws the same mask,
+  or else the one kept in dropout_param['rng']. This is a np.random.Generator
+  when numpy has them, and a np.random.RandomState otherwise.
+  """
+  new_rng = getattr(np.random, 'default_rng', np.random.RandomState)
+  if 'seed' in dropout_param:
+    return new_rng(dropout_param['seed'])
+  if 'rng' not in dropout_param:
+    dropout_param['rng'] = new_rng()
+  return dropout_param['rng']
+
+
 def conv_forward_naive(x, w, b, conv_param):
   """
   A naive implementation of the forward pass for a convolutional layer.
@@ -1,11 +1,49 @@
+import os
+import shutil
+import tempfile
+from distutils.ccompiler import new_compiler
 from distutils.core import setup
+from distutils.errors import CompileError, LinkError
 from distutils.extension import Extension
+from distutils.sysconfig import customize_compiler
 from Cython.Build import cythonize
 import numpy
 
+
+def openmp_flags():
+  """
+  Return the flags that build the kernels with OpenMP if the C compiler can
+  compile and link a small OpenMP program with them, or no flags if it can't
+  (e.g. Apple clang, which rejects -fopenmp); the kernels then run on a single
+  thread.
+  """
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    source = os.path.join(tmp_dir, 'openmp_test.c')
+    with open(source, 'w') as f:
+      f.write('#include <omp.h>\n'
+              'int main(void) { return omp_get_max_threads() < 1; }\n')
+    compiler = new_compiler()
+    customize_compiler(compiler)
+    try:
+      objects = compiler.compile([source], output_dir=tmp_dir,
+                                 extra_postargs=['-fopenmp'])
+      compiler.link_executable(objects, os.path.join(tmp_dir, 'openmp_test'),
+                               extra_postargs=['-fopenmp'])
+    except (CompileError, LinkError):
+      print 'OpenMP is not available; building single-threaded kernels'
+      return []
+    return ['-fopenmp']
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+flags = openmp_flags()
 extensions = [
   Extension('im2col_cython', ['im2col_cython.pyx'],
-            include_dirs = [numpy.get_include()]
+            include_dirs = [numpy.get_include()],
+            extra_compile_args = flags,
+            extra_link_args = flags,
   ),
 ]
 
@@ -99,6 +99,14 @@ class Solver(object):
       iterations.
     - verbose: Boolean; if set to false then no output will be printed during
       training.
+    - flat_params: Boolean; if set to true then all of the parameters of the
+      model are moved into one contiguous buffer (see optim.flatten_params),
+      model.params[k] becomes a view of it, and each step runs the update rule
+      once on the whole buffer instead of once per parameter. The parameters
+      must all have the same dtype, and must only be changed in place while
+      the solver is in use; e.g. weights must be loaded into the model before
+      the solver is constructed. optim_configs then holds a single config
+      under the key 'flat'.
     """
     self.model = model
     self.X_train = data['X_train']
@@ -115,6 +123,7 @@ class Solver(object):
 
     self.print_every = kwargs.pop('print_every', 10)
     self.verbose = kwargs.pop('verbose', True)
+    self.flat_params = kwargs.pop('flat_params', False)
 
     # Throw an error if there are extra keyword arguments
     if len(kwargs) > 0:
@@ -143,6 +152,17 @@ class Solver(object):
     self.train_acc_history = []
     self.val_acc_history = []
 
+    if self.flat_params:
+      # One buffer for all parameters and one for all gradients; the update
+      # rule keeps its state (velocity, moments) for the whole buffer.
+      self._flat_params, self._flat_layout = optim.flatten_params(
+                                               self.model.params)
+      self._flat_grads = np.zeros_like(self._flat_params)
+      self._grad_views = optim.flat_views(self._flat_grads, self._flat_layout)
+      self._best_flat_params = None
+      self.optim_configs = {'flat': dict(self.optim_config)}
+      return
+
     # Make a deep copy of the optim_config for each parameter
     self.optim_configs = {}
     for p in self.model.params:
@@ -166,6 +186,9 @@ class Solver(object):
     self.loss_history.append(loss)
 
     # Perform a parameter update
+    if self.flat_params:
+      self._flat_step(grads)
+      return
     for p, w in self.model.params.iteritems():
       dw = grads[p]
       config = self.optim_configs[p]
@@ -174,6 +197,26 @@ class Solver(object):
       self.optim_configs[p] = next_config
 
 
+  def _flat_step(self, grads):
+    """
+    Gather the gradients into the flat gradient buffer and update all of the
+    parameters with a single call of the update rule. Called by _step when
+    flat_params is set.
+    """
+    # A parameter missing from grads gets a zero gradient, rather than the
+    # one left in its part of the buffer by the previous step
+    if len(grads) < len(self._grad_views):
+      self._flat_grads.fill(0)
+    for p, dw in grads.iteritems():
+      self._grad_views[p][...] = dw
+    config = self.optim_configs['flat']
+    next_w, next_config = self.update_rule(self._flat_params, self._flat_grads,
+                                           config)
+    if next_w is not self._flat_params:
+      self._flat_params[...] = next_w
+    self.optim_configs['flat'] = next_config
+
+
   def check_accuracy(self, X, y, num_samples=None, batch_size=100):
     """
     Check accuracy of the model on the provided data.
@@ -257,10 +300,19 @@ class Solver(object):
         # Keep track of the best model
         if val_acc > self.best_val_acc:
           self.best_val_acc = val_acc
-          self.best_params = {}
-          for k, v in self.model.params.iteritems():
-            self.best_params[k] = v.copy()
-
-    # At the end of training swap the best params into the model
-    self.model.params = self.best_params
+          if self.flat_params:
+            self._best_flat_params = self._flat_params.copy()
+            self.best_params = optim.flat_views(self._best_flat_params,
+                                                self._flat_layout)
+          else:
+            self.best_params = {}
+            for k, v in self.model.params.iteritems():
+              self.best_params[k] = v.copy()
+
+    # At the end of training swap the best params into the model; with flat
+    # params they are copied into the buffer, so that model.params stay views
+    if not self.flat_params:
+      self.model.params = self.best_params
+    elif self._best_flat_params is not None:
+      self._flat_params[...] = self._best_flat_params
 
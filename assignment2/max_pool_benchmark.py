@@ -0,0 +1,60 @@
+import time
+import numpy as np
+from cs231n.layers import max_pool_forward_naive, max_pool_backward_naive
+from cs231n.fast_layers import max_pool_forward_fast, max_pool_backward_fast
+
+# Check max_pool_forward_fast and max_pool_backward_fast against the naive
+# layers, in both layouts, for pooling regions that tile the input (the
+# reshape method) and for ones that don't (the strides method): overlapping
+# 3x3 regions with stride 2, and inputs with rows and columns left over at the
+# bottom and right edges.
+#
+# The errors are zero only because np.random.randn inputs have no ties within
+# a pooling region. Where there are ties, the fast layers give the whole
+# gradient to the first max and the naive layer gives it to every max, so dx
+# differs.
+
+configs = [
+  ((8, 16, 32, 32), {'pool_height': 2, 'pool_width': 2, 'stride': 2}),
+  ((8, 16, 31, 31), {'pool_height': 3, 'pool_width': 3, 'stride': 2}),
+  ((8, 16, 32, 32), {'pool_height': 3, 'pool_width': 3, 'stride': 2}),
+  ((8, 16, 5, 5), {'pool_height': 2, 'pool_width': 2, 'stride': 2}),
+  ((8, 16, 17, 14), {'pool_height': 3, 'pool_width': 2, 'stride': 3}),
+]
+
+def rel_error(x, y):
+  """ returns relative error """
+  return np.max(np.abs(x - y) / (np.maximum(1e-8, np.abs(x) + np.abs(y))))
+
+print '%18s %12s %6s %8s %12s %12s %10s %10s' % (
+      'input', 'pool', 'layout', 'method', 'out error', 'dx error', 'naive s',
+      'fast s')
+for x_shape, pool_param in configs:
+  x = np.random.randn(*x_shape)
+
+  tic = time.time()
+  out_naive, cache_naive = max_pool_forward_naive(x, pool_param)
+  dout = np.random.randn(*out_naive.shape)
+  dx_naive = max_pool_backward_naive(dout, cache_naive)
+  naive_time = time.time() - tic
+
+  for layout in ['NCHW', 'NHWC']:
+    param = dict(pool_param, layout=layout)
+    nhwc = layout == 'NHWC'
+    x_in = x.transpose(0, 2, 3, 1).copy() if nhwc else x
+    dout_in = dout.transpose(0, 2, 3, 1).copy() if nhwc else dout
+
+    tic = time.time()
+    out_fast, cache_fast = max_pool_forward_fast(x_in, param)
+    dx_fast = max_pool_backward_fast(dout_in, cache_fast)
+    fast_time = time.time() - tic
+    if nhwc:
+      out_fast = out_fast.transpose(0, 3, 1, 2)
+      dx_fast = dx_fast.transpose(0, 3, 1, 2)
+
+    print '%18s %12s %6s %8s %12e %12e %10.4f %10.4f' % (
+          'x'.join(map(str, x_shape)),
+          '%dx%d/%d' % (pool_param['pool_height'], pool_param['pool_width'],
+                        pool_param['stride']),
+          layout, cache_fast[0], rel_error(out_naive, out_fast),
+          rel_error(dx_naive, dx_fast), naive_time, fast_time)
@@ -0,0 +1,55 @@
+import time
+import numpy as np
+from cs231n.classifiers.pretrained_cnn import PretrainedCNN
+from cs231n.data_utils import load_tiny_imagenet
+
+# Compare test-time inference of PretrainedCNN with its batchnorm layers run
+# separately and folded into the conv / affine weights by
+# compile_for_inference: check that both give the same scores on the
+# TinyImageNet-100-A validation set, and time a forward pass per minibatch.
+
+batch_size = 100
+num_repeats = 3
+
+data = load_tiny_imagenet('cs231n/datasets/tiny-imagenet-100-A',
+                          subtract_mean=True, packed=True)
+X_val, y_val = data['X_val'], data['y_val']
+model = PretrainedCNN(h5_file='cs231n/datasets/pretrained_model.h5')
+
+def rel_error(x, y):
+  """ Largest difference, relative to the largest magnitude of x """
+  return np.abs(x - y).max() / np.abs(x).max()
+
+def run(X):
+  """
+  Scores for all of X, and the smallest wall clock time of num_repeats
+  forward passes of each minibatch, summed over the minibatches.
+  """
+  scores, total_time = [], 0.0
+  for start in xrange(0, X.shape[0], batch_size):
+    X_batch = X[start:start + batch_size]
+    times = []
+    for _ in xrange(num_repeats):
+      tic = time.time()
+      batch_scores = model.loss(X_batch)
+      times.append(time.time() - tic)
+    scores.append(batch_scores)
+    total_time += min(times)
+  return np.concatenate(scores), total_time
+
+model.folded_params = None
+scores, unfolded_time = run(X_val)
+model.compile_for_inference()
+folded_scores, folded_time = run(X_val)
+
+num_batches = (X_val.shape[0] + batch_size - 1) / batch_size
+print 'scores relative error: ', rel_error(scores, folded_scores)
+print 'same predictions: %f' % np.mean(
+      scores.argmax(axis=1) == folded_scores.argmax(axis=1))
+print 'validation accuracy: unfolded %f, folded %f' % (
+      np.mean(scores.argmax(axis=1) == y_val),
+      np.mean(folded_scores.argmax(axis=1) == y_val))
+print 'batch size %d, ms per batch, best of %d runs' % (batch_size, num_repeats)
+print 'unfolded: %.1f' % (1000 * unfolded_time / num_batches)
+print 'folded: %.1f (%.2fx faster)' % (1000 * folded_time / num_batches,
+                                      unfolded_time / folded_time)
@@ -0,0 +1,102 @@
+import time
+import numpy as np
+from cs231n.classifiers.pretrained_cnn import PretrainedCNN
+from cs231n.fast_layers import conv_forward_fast, conv_backward_fast
+
+# Measure the memory / time trade-off of the recompute_cols option of the fast
+# conv layers on the nine conv layers of PretrainedCNN: how many bytes of
+# im2col columns each layer keeps in its cache between the forward and the
+# backward pass, and how much slower the backward pass gets when it rebuilds
+# them instead.
+
+batch_size = 256
+num_repeats = 3
+
+model = PretrainedCNN(dtype=np.float32)
+
+def best_time(f, *args):
+  """
+  Smallest wall clock time of num_repeats calls of f(*args), and its result.
+  """
+  times = []
+  for _ in xrange(num_repeats):
+    tic = time.time()
+    result = f(*args)
+    times.append(time.time() - tic)
+  return min(times), result
+
+def cache_bytes(cache):
+  """
+  Number of bytes held by the arrays of a conv cache, other than the weights.
+  """
+  x, w, b, conv_param, x_cols = cache
+  return x.nbytes + (0 if x_cols is None else x_cols.nbytes)
+
+print 'batch size %d, times are the best of %d runs' % (batch_size, num_repeats)
+print '%5s %18s %10s %10s %8s %8s %8s %8s' % (
+      'layer', 'input', 'cache MB', 'lean MB', 'fwd s', 'lean fwd', 'bwd s',
+      'lean bwd')
+
+input_size = model.input_size
+prev_dim = 3
+totals = np.zeros(6)
+for i, conv_param in enumerate(model.conv_params):
+  w, b = model.params['W%d' % (i + 1)], model.params['b%d' % (i + 1)]
+  x = np.random.randn(batch_size, prev_dim, input_size, input_size)
+  x = x.astype(np.float32)
+
+  row = []
+  for recompute_cols in [False, True]:
+    param = dict(conv_param, recompute_cols=recompute_cols)
+    fwd_time, (out, cache) = best_time(conv_forward_fast, x, w, b, param)
+    dout = np.random.randn(*out.shape).astype(np.float32)
+    bwd_time, _ = best_time(conv_backward_fast, dout, cache)
+    row.append((cache_bytes(cache), fwd_time, bwd_time))
+    del out, cache, dout
+  (full_bytes, fwd, bwd), (lean_bytes, lean_fwd, lean_bwd) = row
+  stats = np.array([full_bytes / 1e6, lean_bytes / 1e6, fwd, lean_fwd, bwd,
+                    lean_bwd])
+  totals += stats
+  print '%5d %18s %10.1f %10.1f %8.3f %8.3f %8.3f %8.3f' % (
+        (i + 1, 'x'.join(map(str, x.shape))) + tuple(stats))
+
+  prev_dim = w.shape[0]
+  input_size = (input_size + 2 * conv_param['pad'] - w.shape[2])
+  input_size = input_size / conv_param['stride'] + 1
+
+print '%5s %18s %10.1f %10.1f %8.3f %8.3f %8.3f %8.3f' % (
+      (('total', '') + tuple(totals)))
+print ('recompute_cols keeps %.1f MB less in the conv caches of a forward pass '
+       '(%.1fx less) for %.1f%% more forward + backward time' % (
+       totals[0] - totals[1], totals[0] / totals[1],
+       100 * ((totals[3] + totals[5]) / (totals[2] + totals[4]) - 1)))
+
+# The same trade-off for a forward and backward pass through the nine conv
+# layers in a row, which keeps all of their caches alive at once as a training
+# step does. This calls conv_forward_fast directly: the model's own loss runs
+# its conv layers through the fused NCHW conv-batchnorm-relu path, which
+# always recomputes the columns and ignores recompute_cols.
+def conv_stack_step(X, recompute_cols):
+  """
+  Forward and backward pass through the conv layers of the model; returns the
+  number of bytes held by their caches at the end of the forward pass.
+  """
+  caches = []
+  out = X
+  for i, conv_param in enumerate(model.conv_params):
+    w, b = model.params['W%d' % (i + 1)], model.params['b%d' % (i + 1)]
+    param = dict(conv_param, recompute_cols=recompute_cols)
+    out, cache = conv_forward_fast(out, w, b, param)
+    caches.append(cache)
+  held = sum(cache_bytes(cache) for cache in caches)
+  dout = np.ones_like(out)
+  for cache in reversed(caches):
+    dout = conv_backward_fast(dout, cache)[0]
+  return held
+
+X = np.random.randn(batch_size, 3, model.input_size, model.input_size)
+X = X.astype(np.float32)
+for recompute_cols in [False, True]:
+  step_time, held = best_time(conv_stack_step, X, recompute_cols)
+  print ('recompute_cols=%s: conv stack forward + backward %.3fs, '
+         'caches %.1f MB' % (recompute_cols, step_time, held / 1e6))
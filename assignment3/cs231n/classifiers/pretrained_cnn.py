@@ -30,6 +30,9 @@ class PretrainedCNN(object):
     hidden_dim = 512
 
     self.bn_params = []
+
+    # Weights with the test-time batchnorm folded in; see compile_for_inference
+    self.folded_params = None
     
     cur_size = input_size
     prev_dim = 3
@@ -101,6 +104,60 @@ class PretrainedCNN(object):
     for k, v in self.params.iteritems():
       self.params[k] = v.astype(self.dtype)
 
+
+  def fold_batchnorm(self):
+    """
+    Fold the test-time batch normalization of each layer into the weights and
+    biases of its conv or affine transform. At test time batchnorm computes
+    gamma * (a - running_mean) / sqrt(running_var + eps) + beta for the output
+    a = x * W + b of the transform, which is the output of the same transform
+    with its weights and bias scaled by gamma / sqrt(running_var + eps) and the
+    bias shifted.
+
+    Returns:
+    - folded_params: Dictionary with the keys 'W%d' and 'b%d' of self.params
+      for all layers, holding the folded weights and biases for the layers
+      with batchnorm and the unchanged ones for the last layer.
+    """
+    folded_params = {}
+    num_bn_layers = len(self.conv_params) + 1
+    for i in xrange(num_bn_layers):
+      i1 = i + 1
+      bn_param = self.bn_params[i]
+      if 'running_mean' not in bn_param:
+        raise ValueError('Batchnorm layer %d has no running averages yet' % i1)
+      w, b = self.params['W%d' % i1], self.params['b%d' % i1]
+      gamma, beta = self.params['gamma%d' % i1], self.params['beta%d' % i1]
+      eps = bn_param.get('eps', 1e-5)
+      scale = gamma / np.sqrt(bn_param['running_var'] + eps)
+      if i < len(self.conv_params):
+        # Conv weights have shape (F, C, HH, WW); scale each filter
+        w = w * scale.reshape(-1, 1, 1, 1)
+      else:
+        # Affine weights have shape (D, M); scale each output
+        w = w * scale
+      b = (b - bn_param['running_mean']) * scale + beta
+      folded_params['W%d' % i1] = w.astype(self.dtype)
+      folded_params['b%d' % i1] = b.astype(self.dtype)
+    i1 = num_bn_layers + 1
+    folded_params['W%d' % i1] = self.params['W%d' % i1]
+    folded_params['b%d' % i1] = self.params['b%d' % i1]
+    return folded_params
+
+
+  def compile_for_inference(self):
+    """
+    Fold the batchnorm layers into the weights with fold_batchnorm, so that
+    test-mode forward passes run each block as a conv or affine layer followed
+    by a ReLU only. Training-mode forward passes are not affected. Call this
+    again after changing the weights or the running averages, or set
+    self.folded_params to None to go back to the unfolded layers.
+
+    Returns self.
+    """
+    self.folded_params = self.fold_batchnorm()
+    return self
+
   
   def forward(self, X, start=None, end=None, mode='test'):
     """
@@ -126,6 +183,7 @@ class PretrainedCNN(object):
       fully-connected layer, returning class scores. Default is 11.
     - mode: The mode to use, either 'test' or 'train'. We need this because
       batch normalization behaves differently at training time and test time.
+      After compile_for_inference, test mode uses the folded weights.
 
     Returns:
     - out: Output from the end layer.
@@ -137,10 +195,19 @@ class PretrainedCNN(object):
     if end is None: end = len(self.conv_params) + 1
     layer_caches = []
 
+    folded = mode == 'test' and self.folded_params is not None
     prev_a = X
     for i in xrange(start, end + 1):
       i1 = i + 1
-      if 0 <= i < len(self.conv_params):
+      if folded and i < len(self.conv_params):
+        # A conv layer with its batchnorm folded into the weights
+        w, b = self.folded_params['W%d' % i1], self.folded_params['b%d' % i1]
+        next_a, cache = conv_relu_forward(prev_a, w, b, self.conv_params[i])
+      elif folded and i == len(self.conv_params):
+        # The fully-connected hidden layer with its batchnorm folded in
+        w, b = self.folded_params['W%d' % i1], self.folded_params['b%d' % i1]
+        next_a, cache = affine_relu_forward(prev_a, w, b)
+      elif 0 <= i < len(self.conv_params):
         # This is a conv layer
         w, b = self.params['W%d' % i1], self.params['b%d' % i1]
         gamma, beta = self.params['gamma%d' % i1], self.params['beta%d' % i1]
@@ -167,7 +234,7 @@ class PretrainedCNN(object):
       prev_a = next_a
 
     out = prev_a
-    cache = (start, end, layer_caches)
+    cache = (start, end, folded, layer_caches)
     return out, cache
 
 
@@ -191,12 +258,21 @@ class PretrainedCNN(object):
       layers. The grads dictionary will therefore contain a subset of the keys
       of self.params, and grads[k] and self.params[k] will have the same shape.
     """
-    start, end, layer_caches = cache
+    start, end, folded, layer_caches = cache
     dnext_a = dout
     grads = {}
     for i in reversed(range(start, end + 1)):
       i1 = i + 1
-      if i == len(self.conv_params) + 1:
+      if folded and i <= len(self.conv_params):
+        # A layer run with folded weights; its gradients are mapped back to
+        # the parameters of the unfolded layer.
+        if i < len(self.conv_params):
+          temp = conv_relu_backward(dnext_a, layer_caches.pop())
+        else:
+          temp = affine_relu_backward(dnext_a, layer_caches.pop())
+        dprev_a, dw_folded, db_folded = temp
+        grads.update(self._unfold_grads(i, dw_folded, db_folded))
+      elif i == len(self.conv_params) + 1:
         # This is the last fully-connected layer
         dprev_a, dw, db = affine_backward(dnext_a, layer_caches.pop())
         grads['W%d' % i1] = dw
@@ -225,6 +301,33 @@ class PretrainedCNN(object):
     return dX, grads
 
 
+  def _unfold_grads(self, i, dw_folded, db_folded):
+    """
+    Gradients with respect to the weights, bias and batchnorm parameters of
+    layer i, given the gradients with respect to its weights and bias as
+    folded by fold_batchnorm.
+    """
+    i1 = i + 1
+    bn_param = self.bn_params[i]
+    w, b = self.params['W%d' % i1], self.params['b%d' % i1]
+    gamma = self.params['gamma%d' % i1]
+    inv_std = 1.0 / np.sqrt(bn_param['running_var'] + bn_param.get('eps', 1e-5))
+    scale = gamma * inv_std
+    if i < len(self.conv_params):
+      dw = dw_folded * scale.reshape(-1, 1, 1, 1)
+      dw_scale = np.sum(dw_folded * w, axis=(1, 2, 3))
+    else:
+      dw = dw_folded * scale
+      dw_scale = np.sum(dw_folded * w, axis=0)
+    dscale = dw_scale + db_folded * (b - bn_param['running_mean'])
+    return {
+      'W%d' % i1: dw,
+      'b%d' % i1: db_folded * scale,
+      'gamma%d' % i1: dscale * inv_std,
+      'beta%d' % i1: db_folded,
+    }
+
+
   def loss(self, X, y=None):
     """
     Classification loss used to train the network.
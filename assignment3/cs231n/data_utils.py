@@ -1,20 +1,35 @@
 import cPickle as pickle
+import functools
+import multiprocessing
 import numpy as np
 import os
+from multiprocessing.pool import ThreadPool
 from scipy.misc import imread
 
-def load_CIFAR_batch(filename):
+def load_CIFAR_batch(filename, dtype="float"):
   """ load single batch of cifar """
   with open(filename, 'rb') as f:
     datadict = pickle.load(f)
     X = datadict['data']
     Y = datadict['labels']
-    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
     Y = np.array(Y)
     return X, Y
 
-def load_CIFAR10(ROOT):
-  """ load all of cifar """
+def load_CIFAR10(ROOT, mmap=False):
+  """
+  load all of cifar
+
+  With mmap=True the uint8 copy of the dataset written by convert_CIFAR10 is
+  used instead of the pickled batches (it is created on first use). The
+  images are then memory-mapped read-only and returned as LazyFloatArrays,
+  which convert only the images that are indexed to float, so only the
+  minibatches actually used are ever held in memory as floats.
+  """
+  if mmap:
+    paths = convert_CIFAR10(ROOT)
+    Xtr, Ytr, Xte, Yte = [np.load(p, mmap_mode='r') for p in paths]
+    return LazyFloatArray(Xtr), np.array(Ytr), LazyFloatArray(Xte), np.array(Yte)
   xs = []
   ys = []
   for b in range(1,6):
@@ -28,6 +43,94 @@ def load_CIFAR10(ROOT):
   Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
   return Xtr, Ytr, Xte, Yte
 
+def convert_CIFAR10(ROOT, overwrite=False):
+  """
+  Convert the pickled CIFAR-10 batches in ROOT to contiguous uint8 .npy files
+  that can be memory-mapped. This only has to be done once; existing files
+  are kept unless overwrite is True.
+
+  Inputs:
+  - ROOT: Directory holding the CIFAR-10 python batches; the .npy files are
+    written to the same directory.
+  - overwrite: Whether to redo the conversion if the files already exist.
+
+  Returns:
+  A list with the paths of the X_train (50000, 32, 32, 3), y_train, X_test
+  (10000, 32, 32, 3) and y_test arrays.
+  """
+  names = ['X_train', 'y_train', 'X_test', 'y_test']
+  paths = [os.path.join(ROOT, 'cifar10_%s.npy' % name) for name in names]
+  if not overwrite and all(os.path.isfile(p) for p in paths):
+    return paths
+
+  X_train = np.lib.format.open_memmap(paths[0] + '.tmp', mode='w+',
+                                      dtype=np.uint8, shape=(50000, 32, 32, 3))
+  y_train = []
+  for b in range(1,6):
+    f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
+    X, Y = load_CIFAR_batch(f, dtype=np.uint8)
+    X_train[(b - 1) * 10000:b * 10000] = X
+    y_train.append(Y)
+  X_train.flush()
+  del X_train
+  X_test, y_test = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'),
+                                    dtype=np.uint8)
+  arrays = [None, np.concatenate(y_train), X_test, y_test]
+  for path, array in zip(paths, arrays):
+    if array is not None:
+      with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+  # Rename the labels last so a complete set of files means a finished run
+  for path in [paths[0], paths[2], paths[1], paths[3]]:
+    os.rename(path + '.tmp', path)
+  return paths
+
+class LazyFloatArray(object):
+  """
+  Read-only wrapper around an integer array (such as a uint8 memmap) that
+  behaves like its float conversion, but only converts the elements that are
+  indexed. X[batch_mask] or X[start:end] give float arrays; anything that
+  needs the whole array (np.mean(X, axis=0), np.reshape(X, ...)) converts all
+  of it.
+
+  If mean_image is given it is broadcast against data and subtracted from the
+  converted values, so mean subtraction also happens one minibatch at a time.
+  (It is not called mean: np.mean(X) would try to call it as X.mean().)
+  """
+
+  def __init__(self, data, dtype=np.float64, mean_image=None):
+    self.data = data
+    self.dtype = np.dtype(dtype)
+    self.mean_image = mean_image
+
+  @property
+  def shape(self):
+    return self.data.shape
+
+  @property
+  def ndim(self):
+    return self.data.ndim
+
+  @property
+  def size(self):
+    return self.data.size
+
+  def __len__(self):
+    return len(self.data)
+
+  def __getitem__(self, idx):
+    x = np.asarray(self.data[idx], dtype=self.dtype)
+    if self.mean_image is not None:
+      # Indexing the broadcast view only gathers the means that are needed
+      x -= np.broadcast_to(self.mean_image, self.shape)[idx]
+    return x
+
+  def __array__(self, dtype=None):
+    x = np.array(self.data, dtype=self.dtype)
+    if self.mean_image is not None:
+      x -= self.mean_image
+    return x if dtype is None else x.astype(dtype, copy=False)
+
 
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
                      subtract_mean=True):
@@ -71,7 +174,127 @@ def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
     }
     
 
-def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
+def pack_tiny_imagenet(path, n_jobs=-1, overwrite=False, verbose=True):
+  """
+  Decode all TinyImageNet images once and store them as uint8 arrays that
+  load_tiny_imagenet(path, packed=True) can memory-map.
+
+  The JPEGs are decoded by a pool of threads (the decoder releases the GIL)
+  straight into (N, 3, 64, 64) uint8 .npy files in path/packed. The labels,
+  class names, test file names and the mean training image are pickled to
+  path/packed/index.pkl. It is written last, so it only exists once packing
+  has finished, and packing is skipped when it exists.
+
+  Inputs:
+  - path: String giving path to the directory to pack.
+  - n_jobs: Number of decoding threads; -1 uses one per CPU.
+  - overwrite: Whether to repack if a pack already exists.
+  - verbose: Boolean; if true, print progress.
+
+  Returns:
+  The path of the directory holding the pack.
+  """
+  pack_dir = os.path.join(path, 'packed')
+  index_file = os.path.join(pack_dir, 'index.pkl')
+  if os.path.isfile(index_file) and not overwrite:
+    return pack_dir
+  if not os.path.isdir(pack_dir):
+    os.makedirs(pack_dir)
+  if n_jobs == -1:
+    n_jobs = multiprocessing.cpu_count()
+
+  # List the files and labels the same way load_tiny_imagenet does
+  with open(os.path.join(path, 'wnids.txt'), 'r') as f:
+    wnids = [x.strip() for x in f]
+  wnid_to_label = {wnid: i for i, wnid in enumerate(wnids)}
+  with open(os.path.join(path, 'words.txt'), 'r') as f:
+    wnid_to_words = dict(line.split('\t') for line in f)
+  class_names = [[w.strip() for w in wnid_to_words[wnid].split(',')]
+                 for wnid in wnids]
+
+  train_files = []
+  y_train = []
+  for wnid in wnids:
+    boxes_file = os.path.join(path, 'train', wnid, '%s_boxes.txt' % wnid)
+    with open(boxes_file, 'r') as f:
+      filenames = [x.split('\t')[0] for x in f]
+    train_files += [os.path.join(path, 'train', wnid, 'images', img_file)
+                    for img_file in filenames]
+    y_train += [wnid_to_label[wnid]] * len(filenames)
+
+  val_files = []
+  y_val = []
+  with open(os.path.join(path, 'val', 'val_annotations.txt'), 'r') as f:
+    for line in f:
+      img_file, wnid = line.split('\t')[:2]
+      val_files.append(os.path.join(path, 'val', 'images', img_file))
+      y_val.append(wnid_to_label[wnid])
+
+  test_names = os.listdir(os.path.join(path, 'test', 'images'))
+  test_files = [os.path.join(path, 'test', 'images', img_file)
+                for img_file in test_names]
+  y_test = None
+  y_test_file = os.path.join(path, 'test', 'test_annotations.txt')
+  if os.path.isfile(y_test_file):
+    with open(y_test_file, 'r') as f:
+      img_file_to_wnid = {}
+      for line in f:
+        line = line.split('\t')
+        img_file_to_wnid[line[0]] = line[1]
+    y_test = np.array([wnid_to_label[img_file_to_wnid[img_file]]
+                       for img_file in test_names])
+
+  pool = ThreadPool(n_jobs)
+  try:
+    for split, files in [('train', train_files), ('val', val_files),
+                         ('test', test_files)]:
+      X = np.lib.format.open_memmap(os.path.join(pack_dir, 'X_%s.npy' % split),
+                                    mode='w+', dtype=np.uint8,
+                                    shape=(len(files), 3, 64, 64))
+      decode = functools.partial(_decode_tiny_imagenet_image, X, files)
+      done = pool.imap_unordered(decode, xrange(len(files)), chunksize=64)
+      for i, _ in enumerate(done):
+        if verbose and (i + 1) % 10000 == 0:
+          print 'packed %d / %d %s images' % (i + 1, len(files), split)
+      if split == 'train':
+        mean_image = np.zeros((3, 64, 64))
+        for start in xrange(0, len(files), 1000):
+          mean_image += X[start:start + 1000].sum(axis=0)
+        mean_image /= len(files)
+      X.flush()
+      del X
+  finally:
+    pool.terminate()
+    pool.join()
+
+  index = {
+    'class_names': class_names,
+    'wnids': wnids,
+    'y_train': np.array(y_train, dtype=np.int64),
+    'y_val': np.array(y_val),
+    'y_test': y_test,
+    'test_files': test_names,
+    'mean_image': mean_image,
+  }
+  with open(index_file + '.tmp', 'wb') as f:
+    pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+  os.rename(index_file + '.tmp', index_file)
+  return pack_dir
+
+
+def _decode_tiny_imagenet_image(X, files, i):
+  """
+  Decode the image files[i] into X[i], as a 3 x 64 x 64 array.
+  """
+  img = imread(files[i])
+  if img.ndim == 2:
+    ## grayscale file
+    img = img[:, :, np.newaxis]
+  X[i] = img.transpose(2, 0, 1)
+
+
+def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True,
+                       packed=False):
   """
   Load TinyImageNet. Each of TinyImageNet-100-A, TinyImageNet-100-B, and
   TinyImageNet-200 have the same directory structure, so this can be used
@@ -81,6 +304,11 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
   - path: String giving path to the directory to load.
   - dtype: numpy datatype used to load the data.
   - subtract_mean: Whether to subtract the mean training image.
+  - packed: Whether to load the uint8 pack written by pack_tiny_imagenet
+    (which is created on first use) instead of decoding the JPEGs. The images
+    are then returned as LazyFloatArrays over read-only memmaps, which are
+    converted to dtype and have the mean image subtracted one minibatch at a
+    time.
 
   Returns: A dictionary with the following entries:
   - class_names: A list where class_names[i] is a list of strings giving the
@@ -94,6 +322,27 @@ def load_tiny_imagenet(path, dtype=np.float32, subtract_mean=True):
     (such as in student code) then y_test will be None.
   - mean_image: (3, 64, 64) array giving mean training image
   """
+  if packed:
+    pack_dir = pack_tiny_imagenet(path)
+    with open(os.path.join(pack_dir, 'index.pkl'), 'rb') as f:
+      index = pickle.load(f)
+    mean_image = index['mean_image'].astype(dtype)
+    mean = mean_image if subtract_mean else None
+    X_train, X_val, X_test = [
+      LazyFloatArray(np.load(os.path.join(pack_dir, 'X_%s.npy' % split),
+                             mmap_mode='r'), dtype, mean)
+      for split in ['train', 'val', 'test']]
+    return {
+      'class_names': index['class_names'],
+      'X_train': X_train,
+      'y_train': index['y_train'],
+      'X_val': X_val,
+      'y_val': index['y_val'],
+      'X_test': X_test,
+      'y_test': index['y_test'],
+      'mean_image': mean_image,
+    }
+
   # First load wnids
   with open(os.path.join(path, 'wnids.txt'), 'r') as f:
     wnids = [x.strip() for x in f]
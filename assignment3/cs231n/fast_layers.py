@@ -1,20 +1,63 @@
 import numpy as np
+import time
+from cs231n.im2col import *
+
+# The im2col / col2im kernels used by the layers below. The Cython kernels are
+# used when they have been built (run python setup.py build_ext --inplace from
+# the cs231n directory); otherwise we fall back on the NumPy versions from
+# cs231n.im2col, which compute the same thing with a few vectorized operations
+# per kernel offset.
+backends = {
+  'numpy': {
+    'im2col': im2col_strides,
+    'col2im': col2im_strides,
+    'col2im_6d': col2im_6d_strides,
+  },
+}
 try:
   from cs231n.im2col_cython import col2im_cython, im2col_cython
   from cs231n.im2col_cython import col2im_6d_cython
+  backends['cython'] = {
+    'im2col': im2col_cython,
+    'col2im': col2im_cython,
+    'col2im_6d': col2im_6d_cython,
+  }
+  _backend = 'cython'
 except ImportError:
-  print 'run the following from the cs231n directory and try again:'
-  print 'python setup.py build_ext --inplace'
-  print 'You may also need to restart your iPython kernel'
+  _backend = 'numpy'
 
-from cs231n.im2col import *
+
+def set_backend(name):
+  """
+  Choose the im2col / col2im kernels used by the fast layers.
+
+  Inputs:
+  - name: 'cython' or 'numpy'; must be one of the keys of backends.
+  """
+  global _backend
+  if name not in backends:
+    raise ValueError('Unavailable backend "%s"; choose from %s'
+                     % (name, sorted(backends)))
+  _backend = name
+
+
+def get_backend():
+  """
+  Returns the name of the backend used by the fast layers.
+  """
+  return _backend
 
 
 def conv_forward_im2col(x, w, b, conv_param):
   """
   A fast implementation of the forward pass for a convolutional layer
   based on im2col and col2im.
+
+  If conv_param['recompute_cols'] is true, the cache holds only the input and
+  the columns are rebuilt by the backward pass, trading an extra im2col for
+  not keeping a C * HH * WW times larger copy of the input alive until then.
   """
+  assert conv_param.get('layout', 'NCHW') == 'NCHW', 'im2col needs NCHW'
   N, C, H, W = x.shape
   num_filters, _, filter_height, filter_width = w.shape
   stride, pad = conv_param['stride'], conv_param['pad']
@@ -29,28 +72,138 @@ def conv_forward_im2col(x, w, b, conv_param):
   out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
   # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
-  x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
+  x_cols = backends[_backend]['im2col'](x, w.shape[2], w.shape[3], pad, stride)
   res = w.reshape((w.shape[0], -1)).dot(x_cols) + b.reshape(-1, 1)
 
   out = res.reshape(w.shape[0], out.shape[2], out.shape[3], x.shape[0])
   out = out.transpose(3, 0, 1, 2)
 
+  if conv_param.get('recompute_cols', False):
+    x_cols = None
   cache = (x, w, b, conv_param, x_cols)
   return out, cache
 
 
 def conv_forward_strides(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer based
+  on an im2col with as_strided followed by a single matrix multiply.
+
+  If conv_param has a 'workspace' entry (an initially empty dict that the
+  caller keeps, like the running averages in bn_param), the padded input,
+  the columns and the output are written into buffers kept in it, and so is
+  everything conv_backward_strides computes. Buffers are allocated the first
+  time each input shape is seen, so repeated calls with the same shapes do
+  not allocate any large arrays. The returned arrays and cache are then only
+  valid until the next call with the same workspace.
+
+  If conv_param['recompute_cols'] is true, the cache holds only the input and
+  conv_backward_strides rebuilds the columns from it. This only saves memory
+  without a workspace, which keeps its column buffer allocated anyway.
+
+  If conv_param['layout'] is 'NHWC', x and out are channels-last and the
+  work is done by conv_forward_nhwc.
+  """
+  if conv_param.get('layout', 'NCHW') == 'NHWC':
+    return conv_forward_nhwc(x, w, b, conv_param)
   N, C, H, W = x.shape
   F, _, HH, WW = w.shape
   stride, pad = conv_param['stride'], conv_param['pad']
+  workspace = conv_param.get('workspace')
 
   # Check dimensions
   #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
   #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
 
-  # Pad the input
+  # Figure out output dimensions
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+
+  x_cols = _strided_cols(x, HH, WW, pad, stride, workspace)
+
+  # Now all our convolutions are a big matrix multiply
+  res = _workspace_buffer(workspace, 'res', (F, N * out_h * out_w),
+                          np.result_type(w, x_cols))
+  np.dot(w.reshape(F, -1), x_cols, out=res)
+  res += b.reshape(-1, 1)
+
+  # Reshape the output
+  res = res.reshape(F, N, out_h, out_w)
+
+  # Be nice and return a contiguous array
+  # The old version of conv_forward_fast doesn't do this, so for a fair
+  # comparison we won't either
+  out = _workspace_buffer(workspace, 'out', (N, F, out_h, out_w), res.dtype)
+  out[...] = res.transpose(1, 0, 2, 3)
+
+  if conv_param.get('recompute_cols', False):
+    x_cols = None
+  cache = (x, w, b, conv_param, x_cols)
+  return out, cache
+  
+
+def conv_backward_strides(dout, cache):
+  """
+  A fast implementation of the backward pass for a convolutional layer
+  computed with conv_forward_strides.
+  """
+  x, w, b, conv_param, x_cols = cache
+  if conv_param.get('layout', 'NCHW') == 'NHWC':
+    return conv_backward_nhwc(dout, cache)
+  stride, pad = conv_param['stride'], conv_param['pad']
+  workspace = conv_param.get('workspace')
+
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  _, _, out_h, out_w = dout.shape
+
+  if x_cols is None:
+    # The forward pass was run with recompute_cols
+    x_cols = _strided_cols(x, HH, WW, pad, stride, workspace)
+
+  db = np.sum(dout, axis=(0, 2, 3))
+
+  dout_reshaped = _workspace_buffer(workspace, 'dout_reshaped',
+                                    (F, N * out_h * out_w), dout.dtype)
+  dout_reshaped.reshape(F, N, out_h, out_w)[...] = dout.transpose(1, 0, 2, 3)
+  dw = _workspace_buffer(workspace, 'dw', (F, C * HH * WW),
+                         np.result_type(dout_reshaped, x_cols))
+  np.dot(dout_reshaped, x_cols.T, out=dw)
+  dw = dw.reshape(w.shape)
+
+  dx_cols = _workspace_buffer(workspace, 'dx_cols',
+                              (C * HH * WW, N * out_h * out_w),
+                              np.result_type(w, dout_reshaped))
+  np.dot(w.reshape(F, -1).T, dout_reshaped, out=dx_cols)
+  dx_cols = dx_cols.reshape(C, HH, WW, N, out_h, out_w)
+  if workspace is None:
+    col2im_6d = backends[_backend]['col2im_6d']
+    dx = col2im_6d(dx_cols, N, C, H, W, HH, WW, pad, stride)
+  else:
+    dx_padded = _workspace_buffer(workspace, 'dx_padded',
+                                  (C, N, H + 2 * pad, W + 2 * pad),
+                                  dx_cols.dtype)
+    dx = col2im_6d_strides(dx_cols, N, C, H, W, HH, WW, pad, stride,
+                           x_padded=dx_padded)
+
+  return dx, dw, db
+
+
+def _strided_cols(x, HH, WW, pad, stride, workspace=None):
+  """
+  The im2col used by conv_forward_strides: pads x and picks clever strides
+  to build the (C * HH * WW, N * out_h * out_w) column matrix whose row
+  (c, i, j) and column (n, h, w) hold x_padded[n, c, stride * h + i,
+  stride * w + j].
+  """
+  N, C, H, W = x.shape
+
+  # Pad the input; the border of a workspace buffer is never written, so it
+  # stays zero.
   p = pad
-  x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+  x_padded = _workspace_buffer(workspace, 'x_padded',
+                               (N, C, H + 2 * p, W + 2 * p), x.dtype)
+  x_padded[:, :, p:p + H, p:p + W] = x
   
   # Figure out output dimensions
   H += 2 * pad
@@ -64,45 +217,139 @@ def conv_forward_strides(x, w, b, conv_param):
   strides = x.itemsize * np.array(strides)
   x_stride = np.lib.stride_tricks.as_strided(x_padded,
                 shape=shape, strides=strides)
-  x_cols = np.ascontiguousarray(x_stride)
-  x_cols.shape = (C * HH * WW, N * out_h * out_w)
+  x_cols = _workspace_buffer(workspace, 'x_cols',
+                             (C * HH * WW, N * out_h * out_w), x.dtype)
+  x_cols.reshape(shape)[...] = x_stride
+  return x_cols
 
-  # Now all our convolutions are a big matrix multiply
-  res = w.reshape(F, -1).dot(x_cols) + b.reshape(-1, 1)
 
-  # Reshape the output
-  res.shape = (F, N, out_h, out_w)
-  out = res.transpose(1, 0, 2, 3)
+def conv_forward_nhwc(x, w, b, conv_param):
+  """
+  The forward pass of conv_forward_strides for channels-last input, which it
+  uses when conv_param['layout'] is 'NHWC'.
 
-  # Be nice and return a contiguous array
-  # The old version of conv_forward_fast doesn't do this, so for a fair
-  # comparison we won't either
-  out = np.ascontiguousarray(out)
+  Inputs:
+  - x: Input data of shape (N, H, W, C)
+  - w: Filter weights of shape (F, C, HH, WW), as for NCHW input
+  - b: Biases, of shape (F,)
+  - conv_param: As for conv_forward_strides, including the workspace and
+    recompute_cols options.
+
+  Returns a tuple of:
+  - out: Output data, of shape (N, H', W', F)
+  - cache: (x, w, b, conv_param, x_cols)
 
+  With the channels last, the im2col matrix has one row per output position,
+  so the matrix multiply gives the output in NHWC order and, unlike for NCHW,
+  no transposes or layout copies are needed on the way in or out.
+  """
+  N, H, W, C = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  workspace = conv_param.get('workspace')
+
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+
+  x_cols = _strided_cols_nhwc(x, HH, WW, pad, stride, workspace)
+  w_cols = w.transpose(2, 3, 1, 0).reshape(-1, F)
+  out = _workspace_buffer(workspace, 'out', (N * out_h * out_w, F),
+                          np.result_type(x_cols, w_cols))
+  np.dot(x_cols, w_cols, out=out)
+  out += b
+  out = out.reshape(N, out_h, out_w, F)
+
+  if conv_param.get('recompute_cols', False):
+    x_cols = None
   cache = (x, w, b, conv_param, x_cols)
   return out, cache
-  
 
-def conv_backward_strides(dout, cache):
+
+def conv_backward_nhwc(dout, cache):
+  """
+  The backward pass for conv_forward_nhwc; dout and dx are channels-last.
+  """
   x, w, b, conv_param, x_cols = cache
   stride, pad = conv_param['stride'], conv_param['pad']
+  workspace = conv_param.get('workspace')
 
-  N, C, H, W = x.shape
+  N, H, W, C = x.shape
   F, _, HH, WW = w.shape
-  _, _, out_h, out_w = dout.shape
+  _, out_h, out_w, _ = dout.shape
 
-  db = np.sum(dout, axis=(0, 2, 3))
+  if x_cols is None:
+    # The forward pass was run with recompute_cols
+    x_cols = _strided_cols_nhwc(x, HH, WW, pad, stride, workspace)
 
-  dout_reshaped = dout.transpose(1, 0, 2, 3).reshape(F, -1)
-  dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
+  dout_cols = dout.reshape(-1, F)
+  db = np.sum(dout_cols, axis=0)
+
+  dw_cols = _workspace_buffer(workspace, 'dw', (HH * WW * C, F),
+                              np.result_type(x_cols, dout_cols))
+  np.dot(x_cols.T, dout_cols, out=dw_cols)
+  dw = dw_cols.reshape(HH, WW, C, F).transpose(3, 2, 0, 1)
+
+  w_cols = w.transpose(2, 3, 1, 0).reshape(-1, F)
+  dx_cols = _workspace_buffer(workspace, 'dx_cols',
+                              (N * out_h * out_w, HH * WW * C),
+                              np.result_type(dout_cols, w_cols))
+  np.dot(dout_cols, w_cols.T, out=dx_cols)
+  dx_cols = dx_cols.reshape(N, out_h, out_w, HH, WW, C)
 
-  dx_cols = w.reshape(F, -1).T.dot(dout_reshaped)
-  dx_cols.shape = (C, HH, WW, N, out_h, out_w)
-  dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+  dx_padded = _workspace_buffer(workspace, 'dx_padded',
+                                (N, H + 2 * pad, W + 2 * pad, C),
+                                dx_cols.dtype)
+  if workspace is not None:
+    dx_padded.fill(0)
+  for i in xrange(HH):
+    i_max = i + stride * out_h
+    for j in xrange(WW):
+      j_max = j + stride * out_w
+      dx_padded[:, i:i_max:stride, j:j_max:stride] += dx_cols[:, :, :, i, j]
+  dx = dx_padded[:, pad:pad + H, pad:pad + W]
 
   return dx, dw, db
 
 
+def _strided_cols_nhwc(x, HH, WW, pad, stride, workspace=None):
+  """
+  The im2col used by conv_forward_nhwc: the (N * out_h * out_w, HH * WW * C)
+  column matrix whose row (n, h, w) and column (i, j, c) hold
+  x_padded[n, stride * h + i, stride * w + j, c].
+  """
+  N, H, W, C = x.shape
+  p = pad
+  x_padded = _workspace_buffer(workspace, 'x_padded',
+                               (N, H + 2 * p, W + 2 * p, C), x.dtype)
+  x_padded[:, p:p + H, p:p + W] = x
+
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+  s_n, s_h, s_w, s_c = x_padded.strides
+  shape = (N, out_h, out_w, HH, WW, C)
+  strides = (s_n, stride * s_h, stride * s_w, s_h, s_w, s_c)
+  x_stride = np.lib.stride_tricks.as_strided(x_padded,
+                shape=shape, strides=strides)
+  x_cols = _workspace_buffer(workspace, 'x_cols',
+                             (N * out_h * out_w, HH * WW * C), x.dtype)
+  x_cols.reshape(shape)[...] = x_stride
+  return x_cols
+
+
+def _workspace_buffer(workspace, name, shape, dtype):
+  """
+  Get the zero-initialized buffer called name with the given shape and dtype
+  from a conv workspace dict, allocating it if it is not there yet. With
+  workspace=None this just allocates a new array.
+  """
+  if workspace is None:
+    return np.zeros(shape, dtype=dtype)
+  key = (name, shape, np.dtype(dtype))
+  if key not in workspace:
+    workspace[key] = np.zeros(shape, dtype=dtype)
+  return workspace[key]
+
+
 def conv_backward_im2col(dout, cache):
   """
   A fast implementation of the backward pass for a convolutional layer
@@ -114,17 +361,332 @@ def conv_backward_im2col(dout, cache):
   db = np.sum(dout, axis=(0, 2, 3))
 
   num_filters, _, filter_height, filter_width = w.shape
+  if x_cols is None:
+    # The forward pass was run with recompute_cols
+    im2col = backends[_backend]['im2col']
+    x_cols = im2col(x, filter_height, filter_width, pad, stride)
   dout_reshaped = dout.transpose(1, 2, 3, 0).reshape(num_filters, -1)
   dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
 
   dx_cols = w.reshape(num_filters, -1).T.dot(dout_reshaped)
   # dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad, stride)
-  dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
-                     filter_height, filter_width, pad, stride)
+  col2im = backends[_backend]['col2im']
+  dx = col2im(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
+              filter_height, filter_width, pad, stride)
+
+  return dx, dw, db
+
+
+# Transform matrices of Winograd's minimal filtering algorithm F(2x2, 3x3)
+_WINOGRAD_BT = np.array([[1, 0, -1, 0],
+                         [0, 1, 1, 0],
+                         [0, -1, 1, 0],
+                         [0, 1, 0, -1]], dtype=np.float64)
+_WINOGRAD_G = np.array([[1, 0, 0],
+                        [0.5, 0.5, 0.5],
+                        [0.5, -0.5, 0.5],
+                        [0, 0, 1]], dtype=np.float64)
+_WINOGRAD_AT = np.array([[1, 1, 1, 0],
+                         [0, 1, -1, -1]], dtype=np.float64)
+
+
+def _winograd_transform(t, m):
+  """
+  Compute m t m^T for all of the matrices stored along the first two axes of
+  t. Returns an array of shape (m.shape[0], m.shape[0]) + t.shape[2:].
+  """
+  m = m.astype(t.dtype)
+  t = np.tensordot(m, t, axes=([1], [1]))
+  return np.tensordot(m, t, axes=([1], [1]))
+
+
+def _winograd_tiles(x, pad, tiles_h, tiles_w):
+  """
+  Transform the overlapping 4x4 input tiles of x for conv_forward_winograd.
+  Returns V = B^T d B for every tile d, as an array of shape
+  (16, C, N * tiles_h * tiles_w).
+  """
+  N, C, H, W = x.shape
+  # Pad on all sides, and some more at the bottom and right if the output
+  # does not split into a whole number of tiles
+  x_padded = np.zeros((N, C, 2 * tiles_h + 2, 2 * tiles_w + 2), dtype=x.dtype)
+  x_padded[:, :, pad:pad + H, pad:pad + W] = x
+  s_n, s_c, s_h, s_w = x_padded.strides
+  tiles = np.lib.stride_tricks.as_strided(x_padded,
+            shape=(4, 4, C, N, tiles_h, tiles_w),
+            strides=(s_h, s_w, s_c, s_n, 2 * s_h, 2 * s_w))
+  V = _winograd_transform(tiles, _WINOGRAD_BT)
+  return V.reshape(16, C, -1)
+
+
+def conv_forward_winograd(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer with
+  3x3 filters and stride 1, using Winograd's minimal filtering algorithm
+  F(2x2, 3x3).
+
+  The output is computed in 2x2 tiles from overlapping 4x4 input tiles. The
+  input tiles d and the filters g are transformed (V = B^T d B and
+  U = G g G^T), multiplied elementwise and summed over input channels, which
+  for all tiles at once is 16 matrix multiplies of F x C by C x (number of
+  tiles), and transformed back (Y = A^T M A). That takes 16 rather than 36
+  multiplies per tile and channel pair.
+
+  If conv_param['recompute_cols'] is true, the cache holds the input rather
+  than the transformed input tiles, which the backward pass then recomputes.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  assert HH == WW == 3 and stride == 1, 'Winograd needs 3x3 filters, stride 1'
+  assert conv_param.get('layout', 'NCHW') == 'NCHW', 'Winograd needs NCHW'
+
+  out_h = H + 2 * pad - 2
+  out_w = W + 2 * pad - 2
+  tiles_h, tiles_w = (out_h + 1) / 2, (out_w + 1) / 2
+
+  U = _winograd_transform(w.transpose(2, 3, 0, 1), _WINOGRAD_G)
+  U = U.reshape(16, F, C)
+  V = _winograd_tiles(x, pad, tiles_h, tiles_w)
+  M = np.empty((16, F, V.shape[2]), dtype=np.result_type(U, V))
+  for k in xrange(16):
+    np.dot(U[k], V[k], out=M[k])
+
+  Y = _winograd_transform(M.reshape(4, 4, F, N, tiles_h, tiles_w),
+                          _WINOGRAD_AT)
+  out = Y.transpose(3, 2, 4, 0, 5, 1).reshape(N, F, 2 * tiles_h, 2 * tiles_w)
+  out = out[:, :, :out_h, :out_w] + b.reshape(1, -1, 1, 1)
+
+  if conv_param.get('recompute_cols', False):
+    V = None
+  cache = (x, w, b, conv_param, U, V)
+  return out, cache
+
+
+def conv_backward_winograd(dout, cache):
+  """
+  A fast implementation of the backward pass for a convolutional layer
+  computed with conv_forward_winograd. This backpropagates through each step
+  of the forward pass, which gives the exact gradients since the Winograd
+  algorithm computes exactly the same linear function as a convolution.
+  """
+  x, w, b, conv_param, U, V = cache
+  pad = conv_param['pad']
+
+  N, C, H, W = x.shape
+  F = w.shape[0]
+  _, _, out_h, out_w = dout.shape
+  tiles_h, tiles_w = (out_h + 1) / 2, (out_w + 1) / 2
+  if V is None:
+    # The forward pass was run with recompute_cols
+    V = _winograd_tiles(x, pad, tiles_h, tiles_w)
+
+  db = np.sum(dout, axis=(0, 2, 3))
+
+  dY = np.zeros((N, F, 2 * tiles_h, 2 * tiles_w), dtype=dout.dtype)
+  dY[:, :, :out_h, :out_w] = dout
+  dY = dY.reshape(N, F, tiles_h, 2, tiles_w, 2).transpose(3, 5, 1, 0, 2, 4)
+  dM = _winograd_transform(dY, _WINOGRAD_AT.T).reshape(16, F, -1)
+
+  dU = np.empty((16, F, C), dtype=np.result_type(dM, V))
+  dV = np.empty(V.shape, dtype=np.result_type(U, dM))
+  for k in xrange(16):
+    np.dot(dM[k], V[k].T, out=dU[k])
+    np.dot(U[k].T, dM[k], out=dV[k])
+
+  dw = _winograd_transform(dU.reshape(4, 4, F, C), _WINOGRAD_G.T)
+  dw = dw.transpose(2, 3, 0, 1)
+
+  # Add the gradients of the overlapping input tiles back together
+  dd = _winograd_transform(dV.reshape(4, 4, C, N, tiles_h, tiles_w),
+                           _WINOGRAD_BT.T)
+  dx_padded = np.zeros((C, N, 2 * tiles_h + 2, 2 * tiles_w + 2),
+                       dtype=dd.dtype)
+  for i in xrange(4):
+    for j in xrange(4):
+      dx_padded[:, :, i:i + 2 * tiles_h:2, j:j + 2 * tiles_w:2] += dd[i, j]
+  dx = dx_padded.transpose(1, 0, 2, 3)[:, :, pad:pad + H, pad:pad + W]
 
   return dx, dw, db
 
 
+def conv_forward_fft(x, w, b, conv_param):
+  """
+  A fast implementation of the forward pass for a convolutional layer with
+  stride 1 based on the FFT, for large filters.
+
+  A convolutional layer is a sum over input channels of cross-correlations,
+  which become elementwise products in the frequency domain: for every
+  frequency, the transformed output is an N x C by C x F matrix multiply of
+  the transformed input and the conjugate of the transformed filters. The cost
+  does not depend on the filter size.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  assert stride == 1, 'FFT convolution needs stride 1'
+  assert conv_param.get('layout', 'NCHW') == 'NCHW', 'FFT needs NCHW'
+
+  p = pad
+  x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+  H_padded, W_padded = H + 2 * pad, W + 2 * pad
+  out_h, out_w = H_padded - HH + 1, W_padded - WW + 1
+
+  # Frequencies go first so that we can use a stack of matrix multiplies
+  x_freq = np.fft.rfft2(x_padded).reshape(N, C, -1).transpose(2, 0, 1)
+  w_freq = np.fft.rfft2(w, s=(H_padded, W_padded))
+  w_freq = w_freq.reshape(F, C, -1).transpose(2, 1, 0)
+  out_freq = np.matmul(x_freq, w_freq.conj())
+
+  out_freq = out_freq.transpose(1, 2, 0).reshape(N, F, H_padded, -1)
+  out = np.fft.irfft2(out_freq, s=(H_padded, W_padded))[:, :, :out_h, :out_w]
+  out = (out + b.reshape(1, -1, 1, 1)).astype(np.result_type(x, w))
+
+  cache = (x, w, b, conv_param, x_freq, w_freq)
+  return out, cache
+
+
+def conv_backward_fft(dout, cache):
+  """
+  A fast implementation of the backward pass for a convolutional layer
+  computed with conv_forward_fft. The filter gradient is a cross-correlation
+  of the input with the upstream gradient and the input gradient a
+  convolution of the upstream gradient with the filters, so both are again
+  matrix multiplies per frequency.
+  """
+  x, w, b, conv_param, x_freq, w_freq = cache
+  pad = conv_param['pad']
+
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  H_padded, W_padded = H + 2 * pad, W + 2 * pad
+
+  db = np.sum(dout, axis=(0, 2, 3))
+
+  dout_freq = np.fft.rfft2(dout, s=(H_padded, W_padded))
+  dout_freq = dout_freq.reshape(N, F, -1).transpose(2, 0, 1)
+
+  dw_freq = np.matmul(dout_freq.conj().transpose(0, 2, 1), x_freq)
+  dw_freq = dw_freq.transpose(1, 2, 0).reshape(F, C, H_padded, -1)
+  dw = np.fft.irfft2(dw_freq, s=(H_padded, W_padded))[:, :, :HH, :WW]
+  dw = dw.astype(w.dtype)
+
+  dx_freq = np.matmul(dout_freq, w_freq.transpose(0, 2, 1))
+  dx_freq = dx_freq.transpose(1, 2, 0).reshape(N, C, H_padded, -1)
+  dx = np.fft.irfft2(dx_freq, s=(H_padded, W_padded))
+  dx = dx[:, :, pad:pad + H, pad:pad + W].astype(x.dtype)
+
+  return dx, dw, db
+
+
+# All conv implementations, as (forward, backward) pairs
+conv_algorithms = {
+  'im2col': (conv_forward_im2col, conv_backward_im2col),
+  'strides': (conv_forward_strides, conv_backward_strides),
+  'winograd': (conv_forward_winograd, conv_backward_winograd),
+  'fft': (conv_forward_fft, conv_backward_fft),
+}
+
+
+def _is_nchw(conv_param):
+  return conv_param.get('layout', 'NCHW') == 'NCHW'
+
+
+def _filters_fit(x, w, conv_param):
+  """
+  Whether the filters of an NCHW conv layer exactly cover the padded input
+  with the given stride, which the im2col layer checks for.
+  """
+  _, _, H, W = x.shape
+  _, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  return (H + 2 * pad - HH) % stride == 0 and (W + 2 * pad - WW) % stride == 0
+
+
+def _supports_im2col(x, w, conv_param):
+  return _is_nchw(conv_param) and _filters_fit(x, w, conv_param)
+
+
+def _supports_strides(x, w, conv_param):
+  return True
+
+
+def _supports_winograd(x, w, conv_param):
+  return (_is_nchw(conv_param) and w.shape[2:] == (3, 3) and
+          conv_param['stride'] == 1)
+
+
+def _supports_fft(x, w, conv_param):
+  return _is_nchw(conv_param) and conv_param['stride'] == 1
+
+
+# For each conv algorithm, a predicate f(x, w, conv_param) telling whether it
+# supports a layer configuration; conv_forward_auto only tries those that do
+conv_supports = {
+  'im2col': _supports_im2col,
+  'strides': _supports_strides,
+  'winograd': _supports_winograd,
+  'fft': _supports_fft,
+}
+
+# The algorithm picked by conv_forward_auto for each layer configuration
+autotune_choices = {}
+
+
+def conv_forward_auto(x, w, b, conv_param):
+  """
+  Forward pass for a convolutional layer using whichever of conv_algorithms
+  is the fastest for its input shape, filter shape, stride, padding, layout
+  and dtypes.
+
+  The first call for a configuration times a forward and backward pass of
+  every algorithm that supports it on the actual inputs and records the
+  winner in autotune_choices; later calls just use it.
+  """
+  key = (x.shape, w.shape, conv_param['stride'], conv_param['pad'],
+         conv_param.get('layout', 'NCHW'), x.dtype.str, w.dtype.str)
+  if key not in autotune_choices:
+    autotune_choices[key] = _autotune_conv(x, w, b, conv_param)
+  algorithm = autotune_choices[key]
+  out, real_cache = conv_algorithms[algorithm][0](x, w, b, conv_param)
+  cache = (algorithm, real_cache)
+  return out, cache
+
+
+def conv_backward_auto(dout, cache):
+  """
+  Backward pass for a convolutional layer computed with conv_forward_auto.
+  """
+  algorithm, real_cache = cache
+  return conv_algorithms[algorithm][1](dout, real_cache)
+
+
+def _autotune_conv(x, w, b, conv_param, num_trials=2):
+  """
+  Time the forward and backward pass of every conv algorithm that supports
+  the configuration, according to conv_supports, on the given inputs and
+  return the name of the fastest one.
+  """
+  best_time, best_algorithm = None, None
+  for algorithm in sorted(conv_algorithms):
+    if not conv_supports[algorithm](x, w, conv_param):
+      continue
+    forward, backward = conv_algorithms[algorithm]
+    times = []
+    for _ in xrange(num_trials):
+      tic = time.time()
+      out, cache = forward(x, w, b, conv_param)
+      backward(out, cache)
+      times.append(time.time() - tic)
+    if best_time is None or min(times) < best_time:
+      best_time, best_algorithm = min(times), algorithm
+  if best_algorithm is None:
+    raise ValueError('No conv algorithm supports input shape %s, filter shape '
+                     '%s, stride %d and pad %d' % (x.shape, w.shape,
+                     conv_param['stride'], conv_param['pad']))
+  return best_algorithm
+
+
 conv_forward_fast = conv_forward_strides
 conv_backward_fast = conv_backward_strides
 
@@ -133,12 +695,19 @@ def max_pool_forward_fast(x, pool_param):
   """
   A fast implementation of the forward pass for a max pooling layer.
 
-  This chooses between the reshape method and the im2col method. If the pooling
-  regions are square and tile the input image, then we can use the reshape
-  method which is very fast. Otherwise we fall back on the im2col method, which
-  is not much faster than the naive method.
+  This chooses between the reshape method and the strides method. If the
+  pooling regions are square and tile the input image, then we can use the
+  reshape method which is very fast. Otherwise, for overlapping pooling regions
+  such as 3x3 with stride 2 or inputs that they do not tile, we fall back on
+  the strides method.
+
+  If pool_param['layout'] is 'NHWC', x and out are channels-last.
   """
-  N, C, H, W = x.shape
+  nhwc = pool_param.get('layout', 'NCHW') == 'NHWC'
+  if nhwc:
+    N, H, W, C = x.shape
+  else:
+    N, C, H, W = x.shape
   pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
   stride = pool_param['stride']
 
@@ -148,8 +717,8 @@ def max_pool_forward_fast(x, pool_param):
     out, reshape_cache = max_pool_forward_reshape(x, pool_param)
     cache = ('reshape', reshape_cache)
   else:
-    out, im2col_cache = max_pool_forward_im2col(x, pool_param)
-    cache = ('im2col', im2col_cache)
+    out, strides_cache = max_pool_forward_strides(x, pool_param)
+    cache = ('strides', strides_cache)
   return out, cache
 
 
@@ -157,70 +726,142 @@ def max_pool_backward_fast(dout, cache):
   """
   A fast implementation of the backward pass for a max pooling layer.
 
-  This switches between the reshape method an the im2col method depending on
+  This switches between the reshape, strides and im2col methods depending on
   which method was used to generate the cache.
   """
   method, real_cache = cache
   if method == 'reshape':
     return max_pool_backward_reshape(dout, real_cache)
+  elif method == 'strides':
+    return max_pool_backward_strides(dout, real_cache)
   elif method == 'im2col':
     return max_pool_backward_im2col(dout, real_cache)
   else:
     raise ValueError('Unrecognized method "%s"' % method)
 
 
+# Number of bytes of input that _max_pool_argmax processes at a time, so that
+# the passes it makes over each block stay in the cache
+pool_block_bytes = 1 << 19
+
+
 def max_pool_forward_reshape(x, pool_param):
   """
   A fast implementation of the forward pass for the max pooling layer that uses
   some clever reshaping.
 
-  This can only be used for square pooling regions that tile the input.
+  This can only be used for square pooling regions that tile the input. The
+  cache holds only the index i * pool_width + j of the max within each pooling
+  region, as a uint8.
+
+  The maxes and their indices are computed by _max_pool_argmax, one offset
+  (i, j) within the pooling regions at a time, from views of the input, so the
+  input is never copied.
   """
-  N, C, H, W = x.shape
+  nhwc = pool_param.get('layout', 'NCHW') == 'NHWC'
+  if nhwc:
+    N, H, W, C = x.shape
+  else:
+    N, C, H, W = x.shape
   pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
   stride = pool_param['stride']
   assert pool_height == pool_width == stride, 'Invalid pool params'
   assert H % pool_height == 0
   assert W % pool_height == 0
-  x_reshaped = x.reshape(N, C, H / pool_height, pool_height,
-                         W / pool_width, pool_width)
-  out = x_reshaped.max(axis=3).max(axis=4)
+  out, argmax = _max_pool_argmax(x, pool_param, nhwc)
 
-  cache = (x, x_reshaped, out)
+  cache = (x.shape, argmax, nhwc)
   return out, cache
 
 
 def max_pool_backward_reshape(dout, cache):
   """
   A fast implementation of the backward pass for the max pooling layer that
-  uses some clever broadcasting and reshaping.
+  writes the upstream gradient straight into a reshaped view of dx, one
+  offset within the pooling regions at a time.
 
   This can only be used if the forward pass was computed using
   max_pool_forward_reshape.
 
-  NOTE: If there are multiple argmaxes, this method will assign gradient to
-  ALL argmax elements of the input rather than picking one. In this case the
-  gradient will actually be incorrect. However this is unlikely to occur in
-  practice, so it shouldn't matter much. One possible solution is to split the
-  upstream gradient equally among all argmax elements; this should result in a
-  valid subgradient. You can make this happen by uncommenting the line below;
-  however this results in a significant performance penalty (about 40% slower)
-  and is unlikely to matter in practice so we don't do it.
-  """
-  x, x_reshaped, out = cache
-
-  dx_reshaped = np.zeros_like(x_reshaped)
-  out_newaxis = out[:, :, :, np.newaxis, :, np.newaxis]
-  mask = (x_reshaped == out_newaxis)
-  dout_newaxis = dout[:, :, :, np.newaxis, :, np.newaxis]
-  dout_broadcast, _ = np.broadcast_arrays(dout_newaxis, dx_reshaped)
-  dx_reshaped[mask] = dout_broadcast[mask]
-  dx_reshaped /= np.sum(mask, axis=(3, 5), keepdims=True)
-  dx = dx_reshaped.reshape(x.shape)
+  If there are multiple argmaxes in a pooling region, the whole gradient goes
+  to the first one. This differs from the naive implementation, which gives
+  the full gradient to every one of them, so the two only agree on inputs
+  without ties. The same holds for max_pool_backward_strides.
+  """
+  x_shape, argmax, nhwc = cache
+  if nhwc:
+    N, H, W, C = x_shape
+    _, out_height, out_width, _ = dout.shape
+  else:
+    N, C, H, W = x_shape
+    _, _, out_height, out_width = dout.shape
+  pool_height, pool_width = H / out_height, W / out_width
+
+  dx = np.empty(x_shape, dtype=dout.dtype)
+  if nhwc:
+    dx_reshaped = dx.reshape(N, out_height, pool_height, out_width, pool_width,
+                             C)
+  else:
+    dx_reshaped = dx.reshape(N, C, out_height, pool_height, out_width,
+                             pool_width)
+  for i in xrange(pool_height):
+    for j in xrange(pool_width):
+      if nhwc:
+        dx_ij = dx_reshaped[:, :, i, :, j]
+      else:
+        dx_ij = dx_reshaped[:, :, :, i, :, j]
+      np.multiply(dout, argmax == i * pool_width + j, out=dx_ij)
 
   return dx
 
 
+def max_pool_forward_strides(x, pool_param):
+  """
+  An implementation of the forward pass for max pooling for pooling regions
+  that need not tile the input, such as 3x3 regions with stride 2. Supports
+  both layouts.
+
+  The maxes are found by _max_pool_argmax from strided views of the input,
+  without copying it or gathering the windows, and the cache holds only the
+  index i * pool_width + j of the max of each window, as a uint8, so the
+  backward pass needs neither the input nor the windows.
+  """
+  nhwc = pool_param.get('layout', 'NCHW') == 'NHWC'
+  out, argmax = _max_pool_argmax(x, pool_param, nhwc)
+  cache = (x.shape, argmax, pool_param, nhwc)
+  return out, cache
+
+
+def max_pool_backward_strides(dout, cache):
+  """
+  An implementation of the backward pass for max pooling computed with
+  max_pool_forward_strides. The upstream gradient is added into dx one offset
+  (i, j) within the pooling windows at a time, through the strided view of dx
+  holding element (i, j) of every window, for the windows whose max is there.
+  Windows may overlap, but the elements of one view are distinct, so no
+  element is written twice in one pass.
+  """
+  x_shape, argmax, pool_param, nhwc = cache
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+  stride = pool_param['stride']
+  if nhwc:
+    out_height, out_width = argmax.shape[1:3]
+  else:
+    out_height, out_width = argmax.shape[-2:]
+  h_end = stride * (out_height - 1) + 1
+  w_end = stride * (out_width - 1) + 1
+
+  dx = np.zeros(x_shape, dtype=dout.dtype)
+  for i in xrange(pool_height):
+    for j in xrange(pool_width):
+      if nhwc:
+        dx_ij = dx[:, i:i + h_end:stride, j:j + w_end:stride]
+      else:
+        dx_ij = dx[:, :, i:i + h_end:stride, j:j + w_end:stride]
+      np.add(dx_ij, dout, out=dx_ij, where=(argmax == i * pool_width + j))
+  return dx
+
+
 def max_pool_forward_im2col(x, pool_param):
   """
   An implementation of the forward pass for max pooling based on im2col.
@@ -239,7 +880,8 @@ def max_pool_forward_im2col(x, pool_param):
   out_width = (W - pool_width) / stride + 1
 
   x_split = x.reshape(N * C, 1, H, W)
-  x_cols = im2col(x_split, pool_height, pool_width, padding=0, stride=stride)
+  x_cols = backends[_backend]['im2col'](x_split, pool_height, pool_width, 0,
+                                       stride)
   x_cols_argmax = np.argmax(x_cols, axis=0)
   x_cols_max = x_cols[x_cols_argmax, np.arange(x_cols.shape[1])]
   out = x_cols_max.reshape(out_height, out_width, N, C).transpose(2, 3, 0, 1)
@@ -263,8 +905,284 @@ def max_pool_backward_im2col(dout, cache):
   dout_reshaped = dout.transpose(2, 3, 0, 1).flatten()
   dx_cols = np.zeros_like(x_cols)
   dx_cols[x_cols_argmax, np.arange(dx_cols.shape[1])] = dout_reshaped
-  dx = col2im_indices(dx_cols, (N * C, 1, H, W), pool_height, pool_width,
-              padding=0, stride=stride)
+  col2im = backends[_backend]['col2im']
+  dx = col2im(dx_cols, N * C, 1, H, W, pool_height, pool_width, 0, stride)
   dx = dx.reshape(x.shape)
 
   return dx
+
+
+def conv_relu_pool_forward_fused(x, w, b, conv_param, pool_param):
+  """
+  A fused forward pass for a convolution followed by a ReLU and a max pool,
+  for the NCHW layout.
+
+  The bias and the ReLU are applied in place on the output of the conv matrix
+  multiply, and the pooling reads its windows straight from it, in the
+  (F, N, out_h, out_w) order the multiply produces; only the pooled output is
+  transposed to NCHW. Pooling regions need not tile the input.
+
+  The cache holds the input, the index of the max within each pooling window
+  as a uint8 and a bitmask of the pooled outputs the ReLU let through, which
+  are the only ReLU outputs that get a gradient. The conv columns are rebuilt
+  in the backward pass, as with conv_param['recompute_cols'].
+
+  Inputs and outputs are the same as for conv_relu_pool_forward.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  workspace = conv_param.get('workspace')
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+
+  x_cols = _strided_cols(x, HH, WW, pad, stride, workspace)
+  res = _workspace_buffer(workspace, 'res', (F, N * out_h * out_w),
+                          np.result_type(w, x_cols))
+  np.dot(w.reshape(F, -1), x_cols, out=res)
+  res += b.reshape(-1, 1)
+  np.maximum(res, 0, out=res)
+
+  pooled, argmax = _max_pool_argmax(res.reshape(F, N, out_h, out_w),
+                                    pool_param)
+  out = np.ascontiguousarray(pooled.transpose(1, 0, 2, 3))
+  relu_bits = np.packbits(pooled > 0)
+
+  cache = (x, w, conv_param, pool_param, argmax, relu_bits)
+  return out, cache
+
+
+def conv_relu_pool_backward_fused(dout, cache):
+  """
+  Backward pass for conv_relu_pool_forward_fused.
+
+  Returns a tuple of:
+  - dx: Gradient with respect to x
+  - dw: Gradient with respect to w
+  - db: Gradient with respect to b
+  """
+  x, w, conv_param, pool_param, argmax, relu_bits = cache
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+  pool_stride = pool_param['stride']
+  _, _, pooled_h, pooled_w = argmax.shape
+
+  # Gradient of the pooled ReLU outputs, in (F, N, pooled_h, pooled_w) order
+  relu_mask = np.unpackbits(relu_bits)[:argmax.size].reshape(argmax.shape)
+  dpooled = dout.transpose(1, 0, 2, 3) * relu_mask
+
+  # Send it to the max of each window, one window offset at a time
+  dres = np.zeros((F, N * out_h * out_w), dtype=dout.dtype)
+  da = dres.reshape(F, N, out_h, out_w)
+  for i in xrange(pool_height):
+    i_max = i + pool_stride * pooled_h
+    for j in xrange(pool_width):
+      j_max = j + pool_stride * pooled_w
+      da_ij = da[:, :, i:i_max:pool_stride, j:j_max:pool_stride]
+      np.add(da_ij, dpooled, out=da_ij, where=(argmax == i * pool_width + j))
+
+  db = dres.sum(axis=1)
+  dx, dw = _conv_backward_gemm(dres, x, w, conv_param)
+  return dx, dw, db
+
+
+def conv_bn_relu_forward_fused(x, w, b, gamma, beta, conv_param, bn_param):
+  """
+  A fused forward pass for a convolution followed by spatial batch
+  normalization and a ReLU, for the NCHW layout.
+
+  The batchnorm statistics are computed over the rows of the (F, N * out_h *
+  out_w) output of the conv matrix multiply, which is normalized in place;
+  the scale, shift and ReLU are applied while writing the NCHW output. bn_param
+  is used and updated as by batchnorm_forward.
+
+  The cache holds the input, the normalized conv output, the inverse standard
+  deviations and a bitmask of the outputs the ReLU let through. The conv
+  columns are rebuilt in the backward pass, as with
+  conv_param['recompute_cols'].
+
+  Inputs and outputs are the same as for conv_bn_relu_forward.
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  workspace = conv_param.get('workspace')
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+
+  mode = bn_param['mode']
+  eps = bn_param.get('eps', 1e-5)
+  momentum = bn_param.get('momentum', 0.9)
+  running_mean = bn_param.get('running_mean', np.zeros(F, dtype=x.dtype))
+  running_var = bn_param.get('running_var', np.zeros(F, dtype=x.dtype))
+
+  x_cols = _strided_cols(x, HH, WW, pad, stride, workspace)
+  res = _workspace_buffer(workspace, 'res', (F, N * out_h * out_w),
+                          np.result_type(w, x_cols))
+  np.dot(w.reshape(F, -1), x_cols, out=res)
+  res += b.reshape(-1, 1)
+
+  # Normalize in place; res then holds x_hat
+  if mode == 'train':
+    mu = res.mean(axis=1)
+    res -= mu.reshape(-1, 1)
+    var = np.einsum('ij,ij->i', res, res) / res.shape[1]
+    running_mean = momentum * running_mean + (1 - momentum) * mu
+    running_var = momentum * running_var + (1 - momentum) * var
+  elif mode == 'test':
+    res -= running_mean.reshape(-1, 1)
+    var = running_var
+  else:
+    raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+  inv_std = 1.0 / np.sqrt(var + eps)
+  res *= inv_std.reshape(-1, 1)
+  bn_param['running_mean'] = running_mean
+  bn_param['running_var'] = running_var
+
+  out = np.empty((N, F, out_h, out_w), dtype=res.dtype)
+  out_t = out.transpose(1, 0, 2, 3)
+  np.multiply(res.reshape(F, N, out_h, out_w), gamma.reshape(-1, 1, 1, 1),
+              out=out_t)
+  out_t += beta.reshape(-1, 1, 1, 1)
+  np.maximum(out_t, 0, out=out_t)
+  relu_bits = np.packbits(out_t > 0)
+
+  cache = (x, w, gamma, conv_param, mode, res, inv_std, relu_bits)
+  return out, cache
+
+
+def conv_bn_relu_backward_fused(dout, cache):
+  """
+  Backward pass for conv_bn_relu_forward_fused.
+
+  Returns a tuple of:
+  - dx: Gradient with respect to x
+  - dw: Gradient with respect to w
+  - db: Gradient with respect to b
+  - dgamma: Gradient with respect to gamma
+  - dbeta: Gradient with respect to beta
+  """
+  x, w, gamma, conv_param, mode, x_hat, inv_std, relu_bits = cache
+  F, P = x_hat.shape
+  N, _, out_h, out_w = dout.shape
+
+  # Gradient of the batchnorm output, in the (F, N * out_h * out_w) order
+  dres = np.empty((F, P), dtype=dout.dtype)
+  dres.reshape(F, N, out_h, out_w)[...] = dout.transpose(1, 0, 2, 3)
+  dres *= np.unpackbits(relu_bits)[:dres.size].reshape(F, P)
+
+  dbeta = dres.sum(axis=1)
+  dgamma = np.einsum('ij,ij->i', dres, x_hat)
+  if mode == 'train':
+    dres -= (dbeta / P).reshape(-1, 1)
+    dres -= x_hat * (dgamma / P).reshape(-1, 1)
+  dres *= (gamma * inv_std).reshape(-1, 1)
+
+  db = dres.sum(axis=1)
+  dx, dw = _conv_backward_gemm(dres, x, w, conv_param)
+  return dx, dw, db, dgamma, dbeta
+
+
+def _max_pool_argmax(a, pool_param, nhwc=False):
+  """
+  Max pooling for the fast and fused pooling layers. The pooling is over the
+  last two axes of a, or over the two middle axes of an NHWC array if nhwc is
+  true; as in the naive layer, windows that would run past the bottom or
+  right edge are dropped.
+
+  The maxes are found one offset (i, j) within the windows at a time, from
+  the strided view of a holding element (i, j) of every window, so neither a
+  nor the windows are copied. This is done for a block of pool_block_bytes of
+  a at a time, so the passes over each block stay in the cache.
+
+  Returns a tuple of:
+  - out: The maxes
+  - argmax: uint8 array of the same shape giving the index i * pool_width + j
+    of the first max of each window
+  """
+  pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+  stride = pool_param['stride']
+  assert pool_height * pool_width <= 256, 'Pooling regions are too large'
+
+  # Blocks are taken along the first axis of an array with the pooled axes
+  # at 1 and 2: a itself for NHWC, or a stack of 2-D images otherwise
+  if nhwc:
+    N, H, W, C = a.shape
+    blocks = a
+  else:
+    H, W = a.shape[-2:]
+    blocks = a.reshape((-1, H, W))
+  out_height = (H - pool_height) / stride + 1
+  out_width = (W - pool_width) / stride + 1
+  h_end = stride * (out_height - 1) + 1
+  w_end = stride * (out_width - 1) + 1
+
+  if nhwc:
+    out_shape = (N, out_height, out_width, C)
+  else:
+    out_shape = a.shape[:-2] + (out_height, out_width)
+  out = np.empty(out_shape, dtype=a.dtype)
+  argmax = np.zeros(out_shape, dtype=np.uint8)
+  block_shape = (out_height, out_width) + blocks.shape[3:]
+  out_blocks = out.reshape((blocks.shape[0],) + block_shape)
+  argmax_blocks = argmax.reshape(out_blocks.shape)
+
+  rows = max(1, pool_block_bytes * blocks.shape[0] / max(1, a.nbytes))
+  better = np.empty((rows,) + block_shape, dtype=bool)
+  step = np.empty(better.shape, dtype=np.uint8)
+  for start in xrange(0, blocks.shape[0], rows):
+    a_block = blocks[start:start + rows]
+    out_block = out_blocks[start:start + rows]
+    argmax_block = argmax_blocks[start:start + rows]
+    n = a_block.shape[0]
+    for k in xrange(pool_height * pool_width):
+      i, j = k / pool_width, k % pool_width
+      a_ij = a_block[:, i:i + h_end:stride, j:j + w_end:stride]
+      if k == 0:
+        out_block[...] = a_ij
+        continue
+      # Only a strictly larger value moves the max, so ties go to the first
+      # one. The index is set with arithmetic, argmax += better * (k - argmax),
+      # which is much faster than a masked assignment.
+      np.greater(a_ij, out_block, out=better[:n])
+      np.maximum(out_block, a_ij, out=out_block)
+      np.subtract(np.uint8(k), argmax_block, out=step[:n])
+      step[:n] *= better[:n]
+      argmax_block += step[:n]
+  return out, argmax
+
+
+def _conv_backward_gemm(dres, x, w, conv_param):
+  """
+  The matrix multiplies and col2im of the backward pass of a convolution, for
+  the fused layers, given the gradient dres of the (F, N * out_h * out_w)
+  output of the forward matrix multiply. The columns are rebuilt from x, and
+  their buffer is reused for the gradient of the columns when the dtypes
+  agree.
+
+  Returns a tuple of:
+  - dx: Gradient with respect to x
+  - dw: Gradient with respect to w
+  """
+  N, C, H, W = x.shape
+  F, _, HH, WW = w.shape
+  stride, pad = conv_param['stride'], conv_param['pad']
+  out_h = (H + 2 * pad - HH) / stride + 1
+  out_w = (W + 2 * pad - WW) / stride + 1
+
+  x_cols = _strided_cols(x, HH, WW, pad, stride, conv_param.get('workspace'))
+  dw = np.dot(dres, x_cols.T).reshape(w.shape)
+
+  w_t = w.reshape(F, -1).T
+  if x_cols.dtype == np.result_type(w_t, dres):
+    dx_cols = np.dot(w_t, dres, out=x_cols)
+  else:
+    dx_cols = np.dot(w_t, dres)
+  dx_cols = dx_cols.reshape(C, HH, WW, N, out_h, out_w)
+  col2im_6d = backends[_backend]['col2im_6d']
+  dx = col2im_6d(dx_cols, N, C, H, W, HH, WW, pad, stride)
+  return dx, dw
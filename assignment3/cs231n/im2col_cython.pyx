@@ -1,6 +1,7 @@
 import numpy as np
 cimport numpy as np
 cimport cython
+from cython.parallel cimport prange
 
 # DTYPE = np.float64
 # ctypedef np.float64_t DTYPE_t
@@ -9,113 +10,187 @@ ctypedef fused DTYPE_t:
     np.float32_t
     np.float64_t
 
+# All kernels take a num_threads argument giving the number of OpenMP threads
+# to use; the default of 0 leaves it to OpenMP, which uses the number of cores
+# unless the OMP_NUM_THREADS environment variable is set. setup.py only builds
+# the extension with OpenMP when the compiler supports it; without it the
+# prange loops compile to plain loops and the kernels run on a single thread.
+
+
 def im2col_cython(np.ndarray[DTYPE_t, ndim=4] x, int field_height,
-                  int field_width, int padding, int stride):
+                  int field_width, int padding, int stride, int num_threads=0):
     cdef int N = x.shape[0]
     cdef int C = x.shape[1]
     cdef int H = x.shape[2]
     cdef int W = x.shape[3]
-    
-    cdef int HH = (H + 2 * padding - field_height) / stride + 1
-    cdef int WW = (W + 2 * padding - field_width) / stride + 1
 
-    cdef int p = padding
-    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.pad(x,
-            ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    cdef int HH = (H + 2 * padding - field_height) // stride + 1
+    cdef int WW = (W + 2 * padding - field_width) // stride + 1
 
-    cdef np.ndarray[DTYPE_t, ndim=2] cols = np.zeros(
-            (C * field_height * field_width, N * HH * WW),
-            dtype=x.dtype)
+    # Pad the input into (C, H, W, N) order, so that the batch index, which is
+    # innermost in the columns, is innermost in the input too and both the
+    # reads and the writes of the inner loop are contiguous.
+    cdef int p = padding
+    x_padded = np.zeros((C, H + 2 * p, W + 2 * p, N), dtype=x.dtype)
+    x_padded[:, p:p + H, p:p + W, :] = x.transpose(1, 2, 3, 0)
 
-    # Moving the inner loop to a C function with no bounds checking works, but does
-    # not seem to help performance in any measurable way.
+    cols = np.empty((C * field_height * field_width, N * HH * WW),
+                    dtype=x.dtype)
 
-    im2col_cython_inner(cols, x_padded, N, C, H, W, HH, WW,
-                        field_height, field_width, padding, stride)
+    im2col_cython_inner[DTYPE_t](cols, x_padded, N, C, H, W, HH, WW,
+                                 field_height, field_width, padding, stride,
+                                 num_threads)
     return cols
 
 
 @cython.boundscheck(False)
-cdef int im2col_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
-                             np.ndarray[DTYPE_t, ndim=4] x_padded,
+@cython.wraparound(False)
+cdef int im2col_cython_inner(DTYPE_t[:, ::1] cols,
+                             DTYPE_t[:, :, :, ::1] x_padded,
                              int N, int C, int H, int W, int HH, int WW,
-                             int field_height, int field_width, int padding, int stride) except? -1:
-    cdef int c, ii, jj, row, yy, xx, i, col
+                             int field_height, int field_width, int padding,
+                             int stride, int num_threads) except -1:
+    cdef int row
+
+    # Each row of cols is written by one thread, from start to end. OpenMP
+    # needs a positive num_threads, so the default gets a loop without it.
+    with nogil:
+        if num_threads > 0:
+            for row in prange(C * field_height * field_width,
+                              num_threads=num_threads, schedule='static'):
+                im2col_row(cols, x_padded, row, N, HH, WW, field_height,
+                           field_width, stride)
+        else:
+            for row in prange(C * field_height * field_width,
+                              schedule='static'):
+                im2col_row(cols, x_padded, row, N, HH, WW, field_height,
+                           field_width, stride)
+    return 0
 
-    for c in range(C):
-        for yy in range(HH):
-            for xx in range(WW):
-                for ii in range(field_height):
-                    for jj in range(field_width):
-                        row = c * field_width * field_height + ii * field_height + jj
-                        for i in range(N):
-                            col = yy * WW * N + xx * N + i
-                            cols[row, col] = x_padded[i, c, stride * yy + ii, stride * xx + jj]
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline int im2col_row(DTYPE_t[:, ::1] cols,
+                           DTYPE_t[:, :, :, ::1] x_padded, int row, int N,
+                           int HH, int WW, int field_height, int field_width,
+                           int stride) nogil:
+    cdef int c = row // (field_height * field_width)
+    cdef int ii = row // field_width % field_height
+    cdef int jj = row % field_width
+    cdef int yy, xx, i, col
+    for yy in range(HH):
+        for xx in range(WW):
+            col = (yy * WW + xx) * N
+            for i in range(N):
+                cols[row, col + i] = x_padded[c, stride * yy + ii,
+                                              stride * xx + jj, i]
+    return 0
 
 
 def col2im_cython(np.ndarray[DTYPE_t, ndim=2] cols, int N, int C, int H, int W,
-                  int field_height, int field_width, int padding, int stride):
-    cdef np.ndarray x = np.empty((N, C, H, W), dtype=cols.dtype)
-    cdef int HH = (H + 2 * padding - field_height) / stride + 1
-    cdef int WW = (W + 2 * padding - field_width) / stride + 1
-    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * padding, W + 2 * padding),
-                                        dtype=cols.dtype)
-
-    # Moving the inner loop to a C-function with no bounds checking improves
-    # performance quite a bit for col2im.
-    col2im_cython_inner(cols, x_padded, N, C, H, W, HH, WW, 
-                        field_height, field_width, padding, stride)
-    if padding > 0:
-        return x_padded[:, :, padding:-padding, padding:-padding]
-    return x_padded
+                  int field_height, int field_width, int padding, int stride,
+                  int num_threads=0):
+    cdef int HH = (H + 2 * padding - field_height) // stride + 1
+    cdef int WW = (W + 2 * padding - field_width) // stride + 1
+
+    # Accumulate in (C, H, W, N) order, the order of the columns; each channel
+    # is summed by one thread, so no two threads write to the same element.
+    x_padded = np.zeros((C, H + 2 * padding, W + 2 * padding, N),
+                        dtype=cols.dtype)
+    col2im_cython_inner[DTYPE_t](np.ascontiguousarray(cols), x_padded,
+                                 N, C, H, W, HH, WW, field_height, field_width,
+                                 padding, stride, num_threads)
+    x_padded = x_padded.transpose(3, 0, 1, 2)
+    return x_padded[:, :, padding:padding + H, padding:padding + W]
 
 
 @cython.boundscheck(False)
-cdef int col2im_cython_inner(np.ndarray[DTYPE_t, ndim=2] cols,
-                             np.ndarray[DTYPE_t, ndim=4] x_padded,
+@cython.wraparound(False)
+cdef int col2im_cython_inner(DTYPE_t[:, ::1] cols,
+                             DTYPE_t[:, :, :, ::1] x_padded,
                              int N, int C, int H, int W, int HH, int WW,
-                             int field_height, int field_width, int padding, int stride) except? -1:
-    cdef int c, ii, jj, row, yy, xx, i, col
+                             int field_height, int field_width, int padding,
+                             int stride, int num_threads) except -1:
+    cdef int c
+
+    with nogil:
+        if num_threads > 0:
+            for c in prange(C, num_threads=num_threads, schedule='static'):
+                col2im_channel(cols, x_padded, c, N, HH, WW, field_height,
+                               field_width, stride)
+        else:
+            for c in prange(C, schedule='static'):
+                col2im_channel(cols, x_padded, c, N, HH, WW, field_height,
+                               field_width, stride)
+    return 0
+
 
-    for c in range(C):
-        for ii in range(field_height):
-            for jj in range(field_width):
-                row = c * field_width * field_height + ii * field_height + jj
-                for yy in range(HH):
-                    for xx in range(WW):
-                        for i in range(N):
-                            col = yy * WW * N + xx * N + i
-                            x_padded[i, c, stride * yy + ii, stride * xx + jj] += cols[row, col]
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline int col2im_channel(DTYPE_t[:, ::1] cols,
+                               DTYPE_t[:, :, :, ::1] x_padded, int c, int N,
+                               int HH, int WW, int field_height,
+                               int field_width, int stride) nogil:
+    cdef int ii, jj, row, yy, xx, i, col
+    for ii in range(field_height):
+        for jj in range(field_width):
+            row = (c * field_height + ii) * field_width + jj
+            for yy in range(HH):
+                for xx in range(WW):
+                    col = (yy * WW + xx) * N
+                    for i in range(N):
+                        x_padded[c, stride * yy + ii, stride * xx + jj,
+                                 i] += cols[row, col + i]
+    return 0
 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef col2im_6d_cython_inner(np.ndarray[DTYPE_t, ndim=6] cols,
-                            np.ndarray[DTYPE_t, ndim=4] x_padded,
-                            int N, int C, int H, int W, int HH, int WW,
-                            int out_h, int out_w, int pad, int stride):
-
-    cdef int c, hh, ww, n, h, w
-    for n in range(N):
-        for c in range(C):
-            for hh in range(HH):
-                for ww in range(WW):
-                    for h in range(out_h):
-                        for w in range(out_w):
-                            x_padded[n, c, stride * h + hh, stride * w + ww] += cols[c, hh, ww, n, h, w]
-    
+cdef int col2im_6d_cython_inner(DTYPE_t[:, :, :, :, :, ::1] cols,
+                                DTYPE_t[:, :, :, ::1] x_padded,
+                                int N, int C, int H, int W, int HH, int WW,
+                                int out_h, int out_w, int pad, int stride,
+                                int num_threads) except -1:
+
+    cdef int nc
+
+    # Each (n, c) image plane is summed by one thread
+    with nogil:
+        if num_threads > 0:
+            for nc in prange(N * C, num_threads=num_threads,
+                             schedule='static'):
+                col2im_6d_plane(cols, x_padded, nc // C, nc % C, HH, WW,
+                                out_h, out_w, stride)
+        else:
+            for nc in prange(N * C, schedule='static'):
+                col2im_6d_plane(cols, x_padded, nc // C, nc % C, HH, WW,
+                                out_h, out_w, stride)
+    return 0
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline int col2im_6d_plane(DTYPE_t[:, :, :, :, :, ::1] cols,
+                                DTYPE_t[:, :, :, ::1] x_padded, int n, int c,
+                                int HH, int WW, int out_h, int out_w,
+                                int stride) nogil:
+    cdef int hh, ww, h, w
+    for hh in range(HH):
+        for ww in range(WW):
+            for h in range(out_h):
+                for w in range(out_w):
+                    x_padded[n, c, stride * h + hh, stride * w + ww] += cols[c, hh, ww, n, h, w]
+    return 0
+
 
 def col2im_6d_cython(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C, int H, int W,
-        int HH, int WW, int pad, int stride):
-    cdef np.ndarray x = np.empty((N, C, H, W), dtype=cols.dtype)
-    cdef int out_h = (H + 2 * pad - HH) / stride + 1
-    cdef int out_w = (W + 2 * pad - WW) / stride + 1
-    cdef np.ndarray[DTYPE_t, ndim=4] x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad),
-                                                  dtype=cols.dtype)
-
-    col2im_6d_cython_inner(cols, x_padded, N, C, H, W, HH, WW, out_h, out_w, pad, stride)
-
-    if pad > 0:
-        return x_padded[:, :, pad:-pad, pad:-pad]
-    return x_padded 
+        int HH, int WW, int pad, int stride, int num_threads=0):
+    cdef int out_h = (H + 2 * pad - HH) // stride + 1
+    cdef int out_w = (W + 2 * pad - WW) // stride + 1
+    x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad), dtype=cols.dtype)
+
+    col2im_6d_cython_inner[DTYPE_t](np.ascontiguousarray(cols), x_padded,
+                                    N, C, H, W, HH, WW, out_h, out_w, pad,
+                                    stride, num_threads)
+
+    return x_padded[:, :, pad:pad + H, pad:pad + W]
@@ -78,8 +78,10 @@ def conv_relu_forward(x, w, b, conv_param):
   - cache: Object to give to the backward pass
   """
   a, conv_cache = conv_forward_fast(x, w, b, conv_param)
-  out, relu_cache = relu_forward(a)
-  cache = (conv_cache, relu_cache)
+  # The ReLU is applied in place; its output is positive exactly where its
+  # input is, so it can stand in for the input in the ReLU cache.
+  out = np.maximum(a, 0, out=a)
+  cache = (conv_cache, out)
   return out, cache
 
 
@@ -94,15 +96,28 @@ def conv_relu_backward(dout, cache):
 
 
 def conv_bn_relu_forward(x, w, b, gamma, beta, conv_param, bn_param):
+  layout = conv_param.get('layout', 'NCHW')
+  if layout == 'NCHW':
+    out, fused_cache = conv_bn_relu_forward_fused(x, w, b, gamma, beta,
+                                                  conv_param, bn_param)
+    return out, ('fused', fused_cache)
   a, conv_cache = conv_forward_fast(x, w, b, conv_param)
-  an, bn_cache = spatial_batchnorm_forward(a, gamma, beta, bn_param)
+  # The batchnorm gets the layout in a copy of bn_param; only the updated
+  # running averages are stored back into the caller's
+  layout_bn_param = dict(bn_param, layout=layout)
+  an, bn_cache = spatial_batchnorm_forward(a, gamma, beta, layout_bn_param)
+  bn_param['running_mean'] = layout_bn_param['running_mean']
+  bn_param['running_var'] = layout_bn_param['running_var']
   out, relu_cache = relu_forward(an)
-  cache = (conv_cache, bn_cache, relu_cache)
+  cache = ('layers', (conv_cache, bn_cache, relu_cache))
   return out, cache
 
 
 def conv_bn_relu_backward(dout, cache):
-  conv_cache, bn_cache, relu_cache = cache
+  method, real_cache = cache
+  if method == 'fused':
+    return conv_bn_relu_backward_fused(dout, real_cache)
+  conv_cache, bn_cache, relu_cache = real_cache
   dan = relu_backward(dout, relu_cache)
   da, dgamma, dbeta = spatial_batchnorm_backward(dan, bn_cache)
   dx, dw, db = conv_backward_fast(da, conv_cache)
@@ -116,16 +131,25 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
   Inputs:
   - x: Input to the convolutional layer
   - w, b, conv_param: Weights and parameters for the convolutional layer
-  - pool_param: Parameters for the pooling layer
+  - pool_param: Parameters for the pooling layer. The pooling layer always
+    uses the layout ('NCHW' or 'NHWC') given in conv_param.
+
+  In the NCHW layout this uses conv_relu_pool_forward_fused, which does the
+  three layers in one pass without keeping their intermediate outputs.
 
   Returns a tuple of:
   - out: Output from the pooling layer
   - cache: Object to give to the backward pass
   """
+  if conv_param.get('layout', 'NCHW') == 'NCHW':
+    out, fused_cache = conv_relu_pool_forward_fused(x, w, b, conv_param,
+                                                    pool_param)
+    return out, ('fused', fused_cache)
+  pool_param = dict(pool_param, layout=conv_param.get('layout', 'NCHW'))
   a, conv_cache = conv_forward_fast(x, w, b, conv_param)
   s, relu_cache = relu_forward(a)
   out, pool_cache = max_pool_forward_fast(s, pool_param)
-  cache = (conv_cache, relu_cache, pool_cache)
+  cache = ('layers', (conv_cache, relu_cache, pool_cache))
   return out, cache
 
 
@@ -133,7 +157,10 @@ def conv_relu_pool_backward(dout, cache):
   """
   Backward pass for the conv-relu-pool convenience layer
   """
-  conv_cache, relu_cache, pool_cache = cache
+  method, real_cache = cache
+  if method == 'fused':
+    return conv_relu_pool_backward_fused(dout, real_cache)
+  conv_cache, relu_cache, pool_cache = real_cache
   ds = max_pool_backward_fast(dout, pool_cache)
   da = relu_backward(ds, relu_cache)
   dx, dw, db = conv_backward_fast(da, conv_cache)
@@ -135,13 +135,12 @@ def batchnorm_forward(x, gamma, beta, bn_param):
 
     cache = (mode, x, gamma, xc, std, xn, out)
 
-    # Update running average of mean
-    running_mean *= momentum
-    running_mean += (1 - momentum) * mu
+    # Update running average of mean; new arrays, so that arrays the caller
+    # holds are not changed
+    running_mean = momentum * running_mean + (1 - momentum) * mu
 
     # Update running average of variance
-    running_var *= momentum
-    running_var += (1 - momentum) * var
+    running_var = momentum * running_var + (1 - momentum) * var
   elif mode == 'test':
     # Using running mean and variance to normalize
     std = np.sqrt(running_var + eps)
@@ -201,9 +200,13 @@ def batchnorm_backward(dout, cache):
   return dx, dgamma, dbeta
 
 
-def spatial_batchnorm_forward(x, gamma, beta, bn_param):
+def spatial_batchnorm_forward(x, gamma, beta, bn_param, out=None):
   """
   Computes the forward pass for spatial batch normalization.
+
+  The statistics are reduced over the batch and spatial axes of x directly,
+  without transposing it to the (N * H * W, C) input of batchnorm_forward,
+  and the output is computed in place in a single buffer.
   
   Inputs:
   - x: Input data of shape (N, C, H, W)
@@ -218,15 +221,47 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
       default of momentum=0.9 should work well in most situations.
     - running_mean: Array of shape (D,) giving running mean of features
     - running_var Array of shape (D,) giving running variance of features
+    - layout: 'NCHW' (the default) or 'NHWC'. With 'NHWC', x and out have
+      shape (N, H, W, C).
+  - out: Optional array of the same shape and dtype as x, other than x itself,
+    to write the output to.
     
   Returns a tuple of:
   - out: Output data, of shape (N, C, H, W)
-  - cache: Values needed for the backward pass
+  - cache: Values needed for the backward pass: x and per-channel statistics
   """
-  N, C, H, W = x.shape
-  x_flat = x.transpose(0, 2, 3, 1).reshape(-1, C)
-  out_flat, cache = batchnorm_forward(x_flat, gamma, beta, bn_param)
-  out = out_flat.reshape(N, H, W, C).transpose(0, 3, 1, 2)
+  mode = bn_param['mode']
+  eps = bn_param.get('eps', 1e-5)
+  momentum = bn_param.get('momentum', 0.9)
+  nhwc = bn_param.get('layout', 'NCHW') == 'NHWC'
+  axes, shape, C = _spatial_axes(x.shape, nhwc)
+  running_mean = bn_param.get('running_mean', np.zeros(C, dtype=x.dtype))
+  running_var = bn_param.get('running_var', np.zeros(C, dtype=x.dtype))
+
+  if out is None:
+    out = np.empty_like(x)
+  if mode == 'train':
+    mean = x.mean(axis=axes)
+    np.subtract(x, mean.reshape(shape), out=out)
+    subscripts = 'nhwc,nhwc->c' if nhwc else 'nchw,nchw->c'
+    var = np.einsum(subscripts, out, out) / (x.size / C)
+
+    # New arrays, as in batchnorm_forward, rather than in-place updates
+    running_mean = momentum * running_mean + (1 - momentum) * mean
+    running_var = momentum * running_var + (1 - momentum) * var
+  elif mode == 'test':
+    mean, var = running_mean, running_var
+    np.subtract(x, mean.reshape(shape), out=out)
+  else:
+    raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+  inv_std = 1.0 / np.sqrt(var + eps)
+  out *= (gamma * inv_std).reshape(shape)
+  out += beta.reshape(shape)
+
+  bn_param['running_mean'] = running_mean
+  bn_param['running_var'] = running_var
+
+  cache = (mode, x, gamma, mean, inv_std, nhwc)
   return out, cache
 
 
@@ -235,21 +270,46 @@ def spatial_batchnorm_backward(dout, cache):
   Computes the backward pass for spatial batch normalization.
   
   Inputs:
-  - dout: Upstream derivatives, of shape (N, C, H, W)
+  - dout: Upstream derivatives, of shape (N, C, H, W), or (N, H, W, C) if the
+    forward pass used the NHWC layout
   - cache: Values from the forward pass
   
   Returns a tuple of:
-  - dx: Gradient with respect to inputs, of shape (N, C, H, W)
+  - dx: Gradient with respect to inputs, of the same shape as dout
   - dgamma: Gradient with respect to scale parameter, of shape (C,)
   - dbeta: Gradient with respect to shift parameter, of shape (C,)
   """
-  N, C, H, W = dout.shape
-  dout_flat = dout.transpose(0, 2, 3, 1).reshape(-1, C)
-  dx_flat, dgamma, dbeta = batchnorm_backward(dout_flat, cache)
-  dx = dx_flat.reshape(N, H, W, C).transpose(0, 3, 1, 2)
+  mode, x, gamma, mean, inv_std, nhwc = cache
+  axes, shape, C = _spatial_axes(x.shape, nhwc)
+  M = x.size / C
+
+  # x_hat is rebuilt in the buffer that then becomes dx
+  dx = np.subtract(x, mean.reshape(shape))
+  dx *= inv_std.reshape(shape)
+  dbeta = dout.sum(axis=axes)
+  subscripts = 'nhwc,nhwc->c' if nhwc else 'nchw,nchw->c'
+  dgamma = np.einsum(subscripts, dout, dx)
+
+  if mode == 'train':
+    dx *= (-dgamma / M).reshape(shape)
+    dx += dout
+    dx -= (dbeta / M).reshape(shape)
+  else:
+    dx[...] = dout
+  dx *= (gamma * inv_std).reshape(shape)
   return dx, dgamma, dbeta
 
 
+def _spatial_axes(x_shape, nhwc):
+  """
+  The axes that spatial batchnorm reduces over for an input of shape x_shape,
+  the shape that per-channel values broadcast with and the number of channels.
+  """
+  if nhwc:
+    return (0, 1, 2), (1, 1, 1, -1), x_shape[3]
+  return (0, 2, 3), (1, -1, 1, 1), x_shape[1]
+
+
 def svm_loss(x, y):
   """
   Computes the loss and gradient using for multiclass SVM classification.
@@ -26,7 +26,11 @@ well; however the default values of the other hyperparameters should work well
 for a variety of different problems.
 
 For efficiency, update rules may perform in-place updates, mutating w and
-setting next_w equal to w.
+setting next_w equal to w. The rules below all do, and also update the arrays
+they keep in config in place; intermediate results go to a work array kept in
+config['scratch']. Once these are allocated on the first call a step allocates
+nothing of the size of w, which is what lets a Solver run a single update over
+all of the parameters of a model, packed into one buffer by flatten_params.
 """
 
 
@@ -40,7 +44,8 @@ def sgd(w, dw, config=None):
   if config is None: config = {}
   config.setdefault('learning_rate', 1e-2)
 
-  w -= config['learning_rate'] * dw
+  step = np.multiply(dw, config['learning_rate'], out=_scratch(config, w))
+  w -= step
   return w, config
 
 
@@ -63,23 +68,94 @@ def adam(x, dx, config=None):
   config.setdefault('beta1', 0.9)
   config.setdefault('beta2', 0.999)
   config.setdefault('epsilon', 1e-8)
-  config.setdefault('m', np.zeros_like(x))
-  config.setdefault('v', np.zeros_like(x))
+  if config.get('m') is None: config['m'] = np.zeros_like(x)
+  if config.get('v') is None: config['v'] = np.zeros_like(x)
   config.setdefault('t', 0)
   
   next_x = None
   beta1, beta2, eps = config['beta1'], config['beta2'], config['epsilon']
   t, m, v = config['t'], config['m'], config['v']
-  m = beta1 * m + (1 - beta1) * dx
-  v = beta2 * v + (1 - beta2) * (dx * dx)
+  scratch = _scratch(config, x)
+  m *= beta1
+  m += np.multiply(dx, 1 - beta1, out=scratch)
+  v *= beta2
+  np.multiply(dx, dx, out=scratch)
+  scratch *= 1 - beta2
+  v += scratch
   t += 1
   alpha = config['learning_rate'] * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
-  x -= alpha * (m / (np.sqrt(v) + eps))
+  np.sqrt(v, out=scratch)
+  scratch += eps
+  np.divide(m, scratch, out=scratch)
+  scratch *= alpha
+  x -= scratch
   config['t'] = t
-  config['m'] = m
-  config['v'] = v
   next_x = x
   
   return next_x, config
 
-  
+
+def _scratch(config, x):
+  """
+  Work array of the same shape and dtype as x, kept in config so that it is
+  only allocated on the first call of an update rule.
+  """
+  scratch = config.get('scratch')
+  if scratch is None or scratch.shape != x.shape or scratch.dtype != x.dtype:
+    scratch = config['scratch'] = np.empty_like(x)
+  return scratch
+
+
+def flatten_params(params):
+  """
+  Move all of the arrays of a dictionary of parameters into one contiguous
+  buffer, replacing each params[k] by a view of its part of the buffer. An
+  update rule can then be run once on the buffer instead of once per
+  parameter.
+
+  The views stay valid only as long as nothing assigns a new array to
+  params[k]; changes must be made in place, e.g. params[k][...] = value.
+
+  Inputs:
+  - params: Dictionary mapping parameter names to numpy arrays, which must all
+    have the same dtype. It is modified in place.
+
+  Returns a tuple of:
+  - flat: 1-D array holding the values of all of the parameters.
+  - layout: List of (name, start, end, shape) tuples giving the part of flat
+    that holds each parameter; pass it to flat_views to get views of another
+    buffer of the same size, e.g. for the gradients.
+  """
+  names = sorted(params)
+  dtypes = set(np.asarray(params[k]).dtype for k in names)
+  if len(dtypes) > 1:
+    raise ValueError('Cannot flatten parameters of different dtypes %s' %
+                     ', '.join(sorted(str(d) for d in dtypes)))
+
+  layout, start = [], 0
+  for k in names:
+    shape = np.shape(params[k])
+    end = start + int(np.prod(shape))
+    layout.append((k, start, end, shape))
+    start = end
+
+  flat = np.empty(start, dtype=dtypes.pop() if dtypes else np.float64)
+  views = flat_views(flat, layout)
+  for k in names:
+    views[k][...] = params[k]
+    params[k] = views[k]
+  return flat, layout
+
+
+def flat_views(flat, layout):
+  """
+  Split a flat buffer into views shaped like the parameters it holds.
+
+  Inputs:
+  - flat: 1-D array with the size of the buffer returned by flatten_params.
+  - layout: The layout returned by flatten_params.
+
+  Returns:
+  - views: Dictionary mapping parameter names to views of flat.
+  """
+  return {k: flat[start:end].reshape(shape) for k, start, end, shape in layout}
@@ -0,0 +1,87 @@
+import time
+import numpy as np
+from cs231n import optim
+from cs231n.classifiers.pretrained_cnn import PretrainedCNN
+
+# Compare the parameter update of a Solver step done once per parameter, the
+# default, against a single update of all of the parameters packed into one
+# flat buffer (the flat_params option of the solvers), on the parameters of
+# PretrainedCNN and on those of a small ten layer fully-connected net with
+# batchnorm. Only the update is timed; the gradients are random.
+
+num_steps = 100
+num_repeats = 3
+
+def per_param_update(params, grads, update_rule, configs):
+  for p, w in params.iteritems():
+    next_w, configs[p] = update_rule(w, grads[p], configs[p])
+    params[p] = next_w
+
+def flat_update(flat_params, flat_grads, grad_views, grads, update_rule,
+                configs):
+  for p, dw in grads.iteritems():
+    grad_views[p][...] = dw
+  next_w, configs['flat'] = update_rule(flat_params, flat_grads,
+                                        configs['flat'])
+
+def best_time(f, *args):
+  """
+  Smallest wall clock time of num_steps calls of f(*args), over num_repeats
+  runs.
+  """
+  times = []
+  for _ in xrange(num_repeats):
+    tic = time.time()
+    for _ in xrange(num_steps):
+      f(*args)
+    times.append(time.time() - tic)
+  return min(times)
+
+fc_params = {}
+dims = [3 * 32 * 32] + [100] * 10 + [10]
+for i in xrange(len(dims) - 1):
+  fc_params['W%d' % (i + 1)] = np.random.randn(dims[i], dims[i + 1])
+  fc_params['b%d' % (i + 1)] = np.zeros(dims[i + 1])
+  if i < len(dims) - 2:
+    fc_params['gamma%d' % (i + 1)] = np.ones(dims[i + 1])
+    fc_params['beta%d' % (i + 1)] = np.zeros(dims[i + 1])
+
+models = [
+  ('PretrainedCNN', PretrainedCNN(dtype=np.float32).params),
+  ('fc net', {k: v.astype(np.float32) for k, v in fc_params.iteritems()}),
+]
+
+print 'seconds per %d updates, best of %d' % (num_steps, num_repeats)
+print '%14s %8s %10s %8s %10s %10s %8s' % (
+      'model', 'arrays', 'values', 'rule', 'per-param', 'flat', 'speedup')
+for name, model_params in models:
+  grads = {k: np.random.randn(*v.shape).astype(np.float32)
+           for k, v in model_params.iteritems()}
+  num_values = sum(v.size for v in model_params.itervalues())
+
+  for rule in ['sgd', 'sgd_momentum', 'rmsprop', 'adam']:
+    if not hasattr(optim, rule):
+      continue
+    update_rule = getattr(optim, rule)
+    config = {'learning_rate': 1e-6}
+
+    params = {k: v.copy() for k, v in model_params.iteritems()}
+    configs = {p: dict(config) for p in params}
+    per_param_time = best_time(per_param_update, params, grads, update_rule,
+                               configs)
+
+    flat_params, layout = optim.flatten_params(
+                            {k: v.copy() for k, v in model_params.iteritems()})
+    flat_grads = np.zeros_like(flat_params)
+    grad_views = optim.flat_views(flat_grads, layout)
+    configs = {'flat': dict(config)}
+    flat_time = best_time(flat_update, flat_params, flat_grads, grad_views,
+                          grads, update_rule, configs)
+
+    # Both ran the same number of identical updates
+    views = optim.flat_views(flat_params, layout)
+    error = max(np.abs(params[k] - views[k]).max() for k in params)
+    assert error == 0, 'flat update differs by %g' % error
+    print '%14s %8d %10d %8s %10.3f %10.3f %8.2f' % (
+          name, len(model_params), num_values, rule, per_param_time,
+          flat_time, per_param_time / flat_time)
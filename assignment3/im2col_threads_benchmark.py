@@ -0,0 +1,55 @@
+import multiprocessing
+import time
+import numpy as np
+from cs231n.im2col import im2col_strides, col2im_strides, col2im_6d_strides
+from cs231n.im2col_cython import im2col_cython, col2im_cython, col2im_6d_cython
+
+# Measure how the multithreaded Cython im2col / col2im kernels scale with the
+# number of OpenMP threads, against the NumPy kernels, for a 3x3 convolution.
+# Build the extension first: cd cs231n; python setup.py build_ext --inplace
+
+N, C, H, W = 128, 64, 32, 32
+field_height, field_width, pad, stride = 3, 3, 1, 1
+thread_choices = [1, 2, 4, 8, 16]
+num_repeats = 3
+
+out_h = (H + 2 * pad - field_height) / stride + 1
+out_w = (W + 2 * pad - field_width) / stride + 1
+x = np.random.randn(N, C, H, W).astype(np.float32)
+cols = im2col_strides(x, field_height, field_width, pad, stride)
+cols_6d = np.random.randn(C, field_height, field_width, N, out_h, out_w)
+cols_6d = cols_6d.astype(np.float32)
+
+def best_time(f, *args, **kwargs):
+  """ Smallest wall clock time of num_repeats calls of f(*args, **kwargs) """
+  times = []
+  for _ in xrange(num_repeats):
+    tic = time.time()
+    f(*args, **kwargs)
+    times.append(time.time() - tic)
+  return min(times)
+
+def kernel_times(im2col, col2im, col2im_6d, **kwargs):
+  return np.array([
+    best_time(im2col, x, field_height, field_width, pad, stride, **kwargs),
+    best_time(col2im, cols, N, C, H, W, field_height, field_width, pad, stride,
+              **kwargs),
+    best_time(col2im_6d, cols_6d, N, C, H, W, field_height, field_width, pad,
+              stride, **kwargs),
+  ])
+
+print 'input %s, %dx%d filters, %d cores, seconds, best of %d runs' % (
+      'x'.join(map(str, x.shape)), field_height, field_width,
+      multiprocessing.cpu_count(), num_repeats)
+print '%8s %10s %10s %10s %8s' % ('threads', 'im2col', 'col2im', 'col2im_6d',
+                                  'speedup')
+numpy_times = kernel_times(im2col_strides, col2im_strides, col2im_6d_strides)
+print '%8s %10.4f %10.4f %10.4f' % (('numpy',) + tuple(numpy_times))
+single_thread = None
+for num_threads in thread_choices:
+  times = kernel_times(im2col_cython, col2im_cython, col2im_6d_cython,
+                       num_threads=num_threads)
+  if single_thread is None:
+    single_thread = times
+  print '%8d %10.4f %10.4f %10.4f %8.2f' % (
+        (num_threads,) + tuple(times) + (single_thread.sum() / times.sum(),))
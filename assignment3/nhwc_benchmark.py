@@ -0,0 +1,71 @@
+import time
+import numpy as np
+from cs231n.classifiers.pretrained_cnn import PretrainedCNN
+from cs231n.layer_utils import conv_bn_relu_forward, conv_bn_relu_backward
+
+# Compare the NCHW and channels-last (NHWC) layouts on the stack of nine
+# [conv - spatial batchnorm - relu] layers of PretrainedCNN, run forward and
+# backward in training mode. In the NHWC layout activations are passed from
+# layer to layer without any transposes; the input is converted once.
+
+batch_size = 64
+num_repeats = 3
+
+model = PretrainedCNN(dtype=np.float32)
+X = np.random.randn(batch_size, 3, model.input_size, model.input_size)
+X = X.astype(np.float32)
+
+def run_stack(x, layout):
+  """
+  Run the conv layers of the model forward and backward, with the gradient
+  of the output set to the output itself. Returns the output, the gradient of
+  the input and the forward and backward time of every layer.
+  """
+  caches, forward_times, backward_times = [], [], []
+  for i, conv_param in enumerate(model.conv_params):
+    w, b = model.params['W%d' % (i + 1)], model.params['b%d' % (i + 1)]
+    gamma = model.params['gamma%d' % (i + 1)]
+    beta = model.params['beta%d' % (i + 1)]
+    conv_param = dict(conv_param, layout=layout)
+    bn_param = {'mode': 'train'}
+    tic = time.time()
+    x, cache = conv_bn_relu_forward(x, w, b, gamma, beta, conv_param, bn_param)
+    forward_times.append(time.time() - tic)
+    caches.append(cache)
+  out = x
+  dx = out
+  for cache in reversed(caches):
+    tic = time.time()
+    dx = conv_bn_relu_backward(dx, cache)[0]
+    backward_times.append(time.time() - tic)
+  return out, dx, np.array(forward_times), np.array(backward_times[::-1])
+
+def rel_error(x, y):
+  """ Largest difference, relative to the largest magnitude of x """
+  return np.abs(x - y).max() / np.abs(x).max()
+
+results = {}
+for layout in ['NCHW', 'NHWC']:
+  best = None
+  for _ in xrange(num_repeats):
+    x = X if layout == 'NCHW' else X.transpose(0, 2, 3, 1).copy()
+    out, dx, forward_times, backward_times = run_stack(x, layout)
+    times = forward_times + backward_times
+    if best is None or times.sum() < best[2].sum():
+      best = (out, dx, times)
+  results[layout] = best
+
+out, dx, nchw_times = results['NCHW']
+out_nhwc, dx_nhwc, nhwc_times = results['NHWC']
+print 'outputs relative error: ', rel_error(out, out_nhwc.transpose(0, 3, 1, 2))
+print 'input gradients relative error: ', rel_error(
+      dx, dx_nhwc.transpose(0, 3, 1, 2))
+
+print 'batch size %d, forward + backward seconds, best of %d runs' % (
+      batch_size, num_repeats)
+print '%5s %8s %8s %8s' % ('layer', 'NCHW', 'NHWC', 'speedup')
+for i in xrange(len(model.conv_params)):
+  print '%5d %8.3f %8.3f %8.2f' % (i + 1, nchw_times[i], nhwc_times[i],
+                                   nchw_times[i] / nhwc_times[i])
+print '%5s %8.3f %8.3f %8.2f' % ('total', nchw_times.sum(), nhwc_times.sum(),
+                                 nchw_times.sum() / nhwc_times.sum())